@@ -1,47 +1,141 @@
 from search.database import DatabaseBackend, SearchResult
-from search.document import Document, Fields
+from search.document import Document, Fields, collation_key
+from search.pool import pool
+from search.schema import compile_schema
+from search.query import Condition, Range
+from search.database import RANGE_BOUNDS
+from search.compiler import QueryCompiler
+from search import instrumentation
+from contextlib import contextmanager
 import pyes
-from pyes.mappings import StringField, IntegerField
-from pyes.query import Search, StringQuery
-from pyes.exceptions import IndexMissingException
+from pyes.mappings import StringField, IntegerField, FloatField, DateField
+from pyes.query import Search, StringQuery, FilteredQuery, MatchAllQuery, BoolQuery, TermQuery, \
+    TextQuery, PrefixQuery, RangeQuery
+from pyes.filters import RangeFilter, ANDFilter
+from pyes.utils import ESRange
+from pyes.exceptions import IndexMissingException, ElasticSearchException
+import logging
+
+logger = logging.getLogger("search.elasticsearch")
 
 class Backend(DatabaseBackend):
+    """
+    Backend elasticsearch na API pyes 0.19: wyszukiwanie przez search_raw
+    (odpowiedz ES jako slownik), listy indeksow w argumencie indices, mget
+    zwraca ElasticSearchModel (pola _source, metadane w _meta).
+    """
     name       = None
     schema     = None
     hosts      = None
     connection = None
-    stored_fields = []
+    compiled   = None
+    stored_fields = ()
+    sort_fields   = frozenset()
+    bulk_size  = 400
+    compiler   = None
+    #rozmiar facetu terms dla limit = None
+    facet_all_size = 100000
     
-    def __init__(self, name, schema, hosts):
+    def __init__(self, name, schema, hosts, bulk_size = 400):
+        self.bulk_size = bulk_size
         name = name.split("/")
         self.name   = "_".join(name[1:])
         self.type   = name[0]
         self.schema = schema
         self.hosts  = hosts
-        self.schema = self.convert_schema(schema)
+        self.compiled = compile_schema(type(self), schema, self.convert_schema)
+        self.schema = self.compiled.mapping
+        self.stored_fields = self.compiled.stored_fields
+        self.range_fields  = self.compiled.range_fields
+        self.sort_fields   = self.compiled.sort_fields
         
+    """
+    Zapis korzysta z wlasnego polaczenia instancji (self.connection), bo
+    pyes trzyma w nim bufor operacji bulk. Do wyszukiwania sluzy reader().
+    """
     def open(self, write = False):
+        if not write:
+            return
         if not self.connection:
-            self.connection = pyes.ES(self.hosts)
-        if write:
-            try:
-                self.connection.open_index(self.name)
-            except IndexMissingException:
-                self.connection.create_index(self.name)
-                self.connection.put_mapping(self.type, self.schema)
-    
+            self.connection = self.connect()
+        try:
+            self.connection.open_index(self.name)
+        except IndexMissingException:
+            self.connection.create_index(self.name)
+            self.connection.put_mapping(self.type, self.schema)
+            return
+        pool.get(("elasticsearch.mapping", str(self.hosts), self.name, self.type), self.update_mapping, ttl = None)
+
+    """
+    Dopisuje do mapowania istniejacego indeksu nowe pola (np. klucze __isort
+    pol z sort = True) - raz na proces. Dokumenty zapisane wczesniej nie maja
+    tych pol, dopoki nie zostana przeindeksowane. Jesli ES zmapowal juz pole
+    inaczej (np. dynamicznie jako analizowane), mapowania nie da sie zmienic
+    - indeks trzeba przebudowac.
+    """
+    def update_mapping(self):
+        try:
+            self.connection.put_mapping(self.type, self.schema, [self.name])
+        except ElasticSearchException:
+            logger.error("mapping of %s/%s conflicts with the schema - the index needs to be rebuilt",
+                         self.name, self.type, exc_info = True)
+        return True
+
+    def connect(self):
+        return pyes.ES(self.hosts, bulk_size = self.bulk_size)
+
+    """
+    Wypozycza polaczenie do wyszukiwania - wspoldzielone w procesie dla
+    danych hostow. Instancja, ktora ma juz wlasne polaczenie (po zapisie),
+    czyta przez nie.
+    """
+    @contextmanager
+    def reader(self):
+        if self.connection is not None:
+            yield self.connection
+            return
+        with pool.lease(("elasticsearch", str(self.hosts)), self.connect, ttl = self.pool_ttl) as connection:
+            yield connection
+
+    def warmup(self):
+        with self.reader():
+            pass
+
     def add(self, document):
         self.open(True)
-        self.connection.index(document.data, self.name, self.type, id = document.get_uuid(), bulk = True)
+        self.connection.index(self.prepare_document(document), self.name, self.type, id = document.get_uuid(), bulk = True)
         
     def replace(self, uuid, document):
         return self.add(document)
+
+    def add_many(self, documents):
+        self.open(True)
+        for document in documents:
+            self.connection.index(self.prepare_document(document), self.name, self.type, id = document.get_uuid(), bulk = True)
+        self.connection.flush_bulk(forced = True)
+
+    def replace_many(self, documents):
+        return self.add_many(documents)
     
     def remove(self, uuid):
         self.open(True)
         self.connection.delete(self.name, self.type, uuid)
         
+    """
+    Dane do indeksowania - z kluczami sortowania pol z sort = True
+    """
+    def prepare_document(self, document):
+        if not self.sort_fields:
+            return document.data
+        data = dict(document.data)
+        for field in self.sort_fields:
+            data[field+"__isort"] = collation_key(data.get(field))
+        return data
+
     def commit(self):
+        if not self.connection:
+            return
+        self.connection.flush_bulk(forced = True)
         self.connection.refresh([self.name])
         
     def close(self):
@@ -49,51 +143,217 @@ class Backend(DatabaseBackend):
         
     def convert_schema(self, schema):
         out = {}
+        stored_fields = []
+        range_fields  = {}
+        sort_fields   = set()
         for field, field_type in schema.items():
             esfield = StringField
             if type(field_type) == Fields.IntegerField:
                 esfield = IntegerField
+            elif type(field_type) == Fields.FloatField:
+                esfield = FloatField
+            elif type(field_type) == Fields.DateTimeField:
+                esfield = DateField
+            if field_type.range_filter:
+                range_fields[field] = field_type
             esfield = esfield(store = "yes" if field_type.store else "no")
-            if field_type.analyze:
+            if type(field_type) == Fields.CharField and not field_type.split_to_terms:
+                #cala wartosc jako jeden term - facety licza wartosci, nie slowa
+                esfield.index = "not_analyzed"
+            elif field_type.analyze:
                 esfield.index = "analyzed"
             esfield = esfield.as_dict()
             out[field] = esfield
             if field_type.store:
-                self.stored_fields.append(field)
-        return out
+                stored_fields.append(field)
+            if type(field_type) == Fields.CharField and field_type.sort:
+                #nieanalizowany klucz w doc values - sortowanie bez fielddata
+                isort = StringField(store = "no", index = "not_analyzed").as_dict()
+                isort["doc_values"] = True
+                out[field+"__isort"] = isort
+                sort_fields.add(field)
+        return {
+            "mapping"      : out,
+            "stored_fields": stored_fields,
+            "range_fields" : range_fields,
+            "sort_fields"  : frozenset(sort_fields),
+        }
     
+    """
+    Zwraca zapytanie pyes. Zakresy na polach liczbowych i dat sa filtrem
+    range (bez liczenia trafnosci, cache'owanym przez ES), reszta trafia
+    do query_string.
+    """
+    def parse(self, query):
+        if self.compile_queries:
+            parsed, filter = self.query_compiler().compile(self.query_compiler().fold(query))
+            if filter is None:
+                return parsed
+            return FilteredQuery(parsed, filter)
+
+        query_str, ranges = self.split_ranges(query)
+        if ranges and not query_str.strip():
+            parsed = MatchAllQuery()
+        else:
+            parsed = StringQuery(query_str)
+        if not ranges:
+            return parsed
+        return FilteredQuery(parsed, self.range_filter(ranges))
+
+    def query_compiler(self):
+        if self.compiler is None:
+            self.compiler = ElasticSearchCompiler(self)
+        return self.compiler
+
+    def es_range(self, _range):
+        return ESRange(
+            _range.field, _range.start, _range.end,
+            include_lower = _range.start_inclusive,
+            include_upper = _range.end_inclusive
+        )
+
+    def range_filter(self, ranges):
+        filters = [RangeFilter(self.es_range(_range)) for _range in ranges]
+        if len(filters) == 1:
+            return filters[0]
+        return ANDFilter(filters)
+
     def find(self, query, order = {}):
         self.open()
         return ElasticSearchResult(self, query, order)
+
+    def get_many(self, uuids):
+        out = {}
+        with self.reader() as connection:
+            for doc in connection.mget(uuids, index = self.name, doc_type = self.type):
+                #ES < 1.0 zwraca "exists", nowsze "found"
+                if doc._meta.get("exists") or doc._meta.get("found"):
+                    out[doc._meta["id"]] = self.stored_data(doc)
+        return out
+
+    def count(self, query):
+        with self.reader() as connection:
+            return connection.count(self.parse(query), indices = [self.name])["count"]
+
+    def facets(self, query, fields, limit = 100):
+        search = Search(self.parse(query), size = 0)
+        for field in fields:
+            search.facet.add_term_facet(field, size = limit if limit is not None else self.facet_all_size)
+        with self.reader() as connection:
+            search_result = connection.search_raw(search, indices = [self.name])
+        return {
+            field: dict((term["term"], term["count"]) for term in search_result["facets"][field]["terms"])
+            for field in fields
+        }
+
+    def stored_data(self, source):
+        return {field: source.get(field, None) for field in self.stored_fields}
+
+    def stored_value(self, source, field):
+        if field not in self.stored_fields:
+            return None
+        return source.get(field)
     
+class ElasticSearchCompiler(QueryCompiler):
+    """
+    Buduje zapytanie bool ES z AST - warunki tekstowe to zapytania text
+    (analizowane tak jak pole), liczby i daty to term / range.
+    """
+    def emit_all(self):
+        return MatchAllQuery()
+
+    def emit_none(self):
+        return BoolQuery(must_not = [MatchAllQuery()])
+
+    def emit_and(self, queries):
+        return BoolQuery(must = queries)
+
+    def emit_or(self, queries):
+        return BoolQuery(should = queries, minimum_number_should_match = 1)
+
+    def emit_range(self, _range):
+        return RangeQuery(self.engine.es_range(_range))
+
+    def emit_filter(self, ranges):
+        return self.engine.range_filter(ranges)
+
+    def emit_raw(self, text):
+        return StringQuery(text)
+
+    def emit_condition(self, field, operator, value):
+        if field in self.engine.range_fields:
+            return TermQuery(field, value)
+        if operator != Condition.OPERATOR_CONTAINS:
+            bound, inclusive = RANGE_BOUNDS[operator]
+            if bound == "start":
+                return self.emit_range(Range(field, value, inclusive, None, True))
+            return self.emit_range(Range(field, None, True, value, inclusive))
+
+        if value.rstrip().endswith("*"):
+            words = value.rstrip().rstrip("*").split()
+            if not words:
+                return MatchAllQuery()
+            prefix = PrefixQuery(field, words[-1].lower())
+            if len(words) == 1:
+                return prefix
+            return BoolQuery(must = [TextQuery(field, u" ".join(words[:-1]), operator = "and"), prefix])
+        return TextQuery(field, value, operator = "and")
+
 class ElasticSearchResult(SearchResult):
+    scroll = "5m"
+
     def __init__(self, engine, query, order):
         self.query  = query
-        self.order = order
+        self.order = None
         self.engine = engine
+        if order:
+            self.order = []
+            for field, sort_order in order.items():
+                if field in engine.sort_fields:
+                    field += "__isort"
+                self.order.append({field: sort_order})
 
-    def page(self, page, limit):
-        _results = []
-        search_result = self.engine.connection.search(
-            Search(StringQuery(self.query),
-            sort = self.order,
-            size = limit,
-            start = ((page - 1) * limit)),
-            indexes = [self.engine.name]
-        )
-        
-        self.rows = search_result.total
-        doc_class = self.engine.database.document
+    def _stored(self, start, limit):
+        with instrumentation.timer("parse"):
+            parsed = self.engine.parse(self.query)
+        with self.engine.reader() as connection:
+            with instrumentation.timer("search"):
+                search_result = connection.search_raw(
+                    Search(parsed,
+                    sort = self.order,
+                    size = limit,
+                    start = start),
+                    indices = [self.engine.name]
+                )
         
-        for result in search_result["hits"]["hits"]:
-            _results.append(
-                Document(
-                    data = {field: result["_source"].get(field, None) for field in self.engine.stored_fields},
-                    restore = True
+            self.rows = search_result["hits"]["total"]
+            with instrumentation.timer("load"):
+                return [result["_source"] for result in search_result["hits"]["hits"]]
+
+    """
+    Kursorem jest scroll_id - ES utrzymuje kontekst wyszukiwania po swojej
+    stronie, wiec kolejne strony nie wymagaja ponownego zbierania start + limit
+    trafien.
+    """
+    def _after(self, cursor, limit):
+        with self.engine.reader() as connection:
+            if cursor is None:
+                search_result = connection.search_raw(
+                    Search(self.engine.parse(self.query),
+                    sort = self.order,
+                    size = limit),
+                    indices = [self.engine.name],
+                    scroll = self.scroll
                 )
-            )
-        return _results
-    
+                self.rows = search_result["hits"]["total"]
+            else:
+                search_result = connection.search_scroll(cursor, scroll = self.scroll)
+
+        hits = [self.engine.stored_data(result["_source"]) for result in search_result["hits"]["hits"]]
+        if not hits:
+            return hits, None
+        return hits, search_result["_scroll_id"]
+
     def __enter__(self):
         return self
     
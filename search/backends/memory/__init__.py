@@ -0,0 +1,275 @@
+from search.database import DatabaseBackend, SearchResult
+from search.document import Fields, collation_key
+from search.query import Condition, Conjunction, RawQuery
+from search.exceptions import NeedToReimplementThisMethodException
+from search.schema import compile_schema
+from search import instrumentation
+
+from collections import OrderedDict
+import re
+import threading
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+_words = re.compile(r"\w+", re.UNICODE)
+
+
+class MemoryIndex(object):
+    """
+    Indeks odwrocony trzymany w pamieci procesu. Wspoldzielony przez
+    wszystkie bazy o tej samej nazwie.
+    """
+    def __init__(self):
+        self.documents = OrderedDict()
+        self.postings = {}
+        self.values = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+
+class Backend(DatabaseBackend):
+    """
+    Czysto pythonowy backend referencyjny - nie wymaga zadnych zewnetrznych
+    bibliotek, wiec nadaje sie do testow i benchmarkow. Zmiany sa widoczne
+    dopiero po commit().
+    """
+    name          = None
+    schema        = None
+    index         = None
+    compiled      = None
+    uuid_field    = None
+
+    def __init__(self, name, schema):
+        self.name    = name
+        self.schema  = schema
+        self.pending = []
+        self.compiled       = compile_schema(type(self), schema, self.convert_schema)
+        self.uuid_field     = self.compiled.uuid_field
+        self.stored_fields  = self.compiled.stored_fields
+        self.sort_fields    = self.compiled.sort_fields
+        self.integer_fields = self.compiled.integer_fields
+        self.exact_fields   = self.compiled.exact_fields
+        self.range_fields   = self.compiled.range_fields
+        with _indexes_lock:
+            self.index = _indexes.setdefault(name, MemoryIndex())
+
+    def convert_schema(self, schema):
+        uuid_field     = None
+        stored_fields  = []
+        sort_fields    = set()
+        integer_fields = set()
+        exact_fields   = set()
+        range_fields   = {}
+        for field, field_type in schema.items():
+            if type(field_type) == Fields.UUIDField:
+                uuid_field = field
+                exact_fields.add(field)
+            elif type(field_type) == Fields.IntegerField:
+                integer_fields.add(field)
+            elif type(field_type) == Fields.CharField and field_type.split_to_terms == False:
+                exact_fields.add(field)
+            if field_type.range_filter:
+                range_fields[field] = field_type
+            if field_type.store:
+                stored_fields.append(field)
+            if type(field_type) == Fields.CharField and field_type.sort:
+                sort_fields.add(field)
+
+        return {
+            "uuid_field"    : uuid_field,
+            "stored_fields" : stored_fields,
+            "sort_fields"   : sort_fields,
+            "integer_fields": integer_fields,
+            "exact_fields"  : exact_fields,
+            "range_fields"  : range_fields,
+        }
+
+    def open(self, write = False):
+        pass
+
+    def close(self):
+        pass
+
+    def add(self, document):
+        self.pending.append(("add", document.get_uuid(), dict(document.data)))
+
+    def replace(self, uuid, document):
+        self.pending.append(("add", uuid, dict(document.data)))
+
+    def remove(self, uuid):
+        self.pending.append(("remove", uuid, None))
+
+    def rollback(self):
+        self.pending = []
+
+    def commit(self):
+        pending, self.pending = self.pending, []
+        with self.index.lock:
+            for action, uuid, data in pending:
+                self._unindex(uuid)
+                if action == "add":
+                    self._index(uuid, data)
+            self.index.generation += 1
+
+    def _index(self, uuid, data):
+        self.index.documents[uuid] = data
+        for field, value in data.items():
+            if field not in self.schema or value is None:
+                continue
+            if field in self.range_fields:
+                self.index.values.setdefault(field, {})[uuid] = self.range_fields[field].convert(value)
+            for term in self.terms(field, value):
+                self.index.postings.setdefault((field, term), set()).add(uuid)
+
+    def _unindex(self, uuid):
+        data = self.index.documents.pop(uuid, None)
+        if data is None:
+            return
+        for field, value in data.items():
+            if field not in self.schema or value is None:
+                continue
+            if field in self.range_fields:
+                self.index.values.get(field, {}).pop(uuid, None)
+            for term in self.terms(field, value):
+                postings = self.index.postings.get((field, term))
+                if postings is not None:
+                    postings.discard(uuid)
+                    if not postings:
+                        del self.index.postings[(field, term)]
+
+    def terms(self, field, value):
+        if field in self.integer_fields:
+            return [str(int(value))]
+        if field in self.range_fields:
+            return [self.range_fields[field].convert(value)]
+        if field in self.exact_fields:
+            return [value]
+        return set(word.lower() for word in _words.findall(value))
+
+    def find(self, query, order = None):
+        return MemorySearchResult(self, query, order)
+
+    """
+    Zwraca zbior uuid dokumentow pasujacych do zapytania
+    """
+    def match(self, query):
+        if isinstance(query, RawQuery):
+            #backend nie ma wlasnej skladni tekstowej zapytan
+            raise NeedToReimplementThisMethodException("match(RawQuery)")
+        parts = [self.match_condition(condition) for condition in query.conditions]
+        parts.extend(self.match(subquery) for subquery in query.subqueries)
+        if not parts:
+            return set(self.index.documents)
+        if query.conjunction == Conjunction.OR:
+            return set.union(*parts)
+        return set.intersection(*parts)
+
+    def match_condition(self, condition):
+        field, value = condition.field, condition.value
+        if condition.operator != Condition.OPERATOR_CONTAINS:
+            if field not in self.range_fields:
+                return set()
+            value = self.range_fields[field].convert(value)
+            values = self.index.values.get(field, {})
+            if condition.operator == Condition.OPERATOR_LESS_THAN:
+                return set(uuid for uuid, v in values.items() if v < value)
+            elif condition.operator == Condition.OPERATOR_LESS_EQUAL:
+                return set(uuid for uuid, v in values.items() if v <= value)
+            elif condition.operator == Condition.OPERATOR_GREATER_THAN:
+                return set(uuid for uuid, v in values.items() if v > value)
+            return set(uuid for uuid, v in values.items() if v >= value)
+
+        if field in self.range_fields or field in self.exact_fields:
+            return set(self.index.postings.get((field, self.terms(field, value)[0]), ()))
+
+        words = [word.lower() for word in _words.findall(value)]
+        prefix = value.rstrip().endswith("*")
+        matches = None
+        for i, word in enumerate(words):
+            if prefix and i == len(words) - 1:
+                postings = set()
+                for (_field, term), uuids in self.index.postings.items():
+                    if _field == field and term.startswith(word):
+                        postings |= uuids
+            else:
+                postings = self.index.postings.get((field, word), set())
+            matches = postings if matches is None else matches & postings
+        return set(matches or ())
+
+    def sort_key(self, field, value):
+        if field in self.sort_fields:
+            return collation_key(value)
+        return value
+
+    def get_many(self, uuids):
+        out = {}
+        for uuid in uuids:
+            data = self.index.documents.get(uuid)
+            if data is not None:
+                out[uuid] = self.stored_data(data)
+        return out
+
+    def count(self, query):
+        return len(self.match(query))
+
+    def generation(self):
+        return self.index.generation
+
+    def facets(self, query, fields, limit = 100):
+        uuids = self.match(query)
+        out = {}
+        for field in fields:
+            counts = {}
+            for uuid in uuids:
+                value = self.index.documents[uuid].get(field)
+                if value is not None:
+                    counts[value] = counts.get(value, 0) + 1
+            out[field] = self.top_counts(counts, limit)
+        return out
+
+    def stored_data(self, stored):
+        return {field: stored.get(field, None) for field in self.stored_fields}
+
+    def stored_value(self, stored, field):
+        if field not in self.stored_fields:
+            return None
+        return stored.get(field)
+
+
+class MemorySearchResult(SearchResult):
+    def __init__(self, engine, query, order):
+        self.engine = engine
+        self.query  = query
+        self.order  = order
+        self.uuids  = None
+
+    """
+    Trafienia sa wyliczane i sortowane raz, kolejne strony to wycinki listy
+    """
+    def matches(self):
+        if self.uuids is None:
+            documents = self.engine.index.documents
+            with instrumentation.timer("search"):
+                matched = self.engine.match(self.query)
+                uuids = [uuid for uuid in documents if uuid in matched]
+                for field, sort_order in reversed(list((self.order or {}).items())):
+                    uuids.sort(
+                        key = lambda uuid: self.engine.sort_key(field, documents[uuid].get(field)),
+                        reverse = (sort_order == "desc")
+                    )
+            self.uuids = uuids
+            self.rows = len(uuids)
+        return self.uuids
+
+    def _stored(self, start, limit):
+        documents = self.engine.index.documents
+        uuids = self.matches()[start:start + limit]
+        with instrumentation.timer("load"):
+            return [documents[uuid] for uuid in uuids if uuid in documents]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        pass
@@ -1,15 +1,29 @@
 from search.database import DatabaseBackend, SearchResult
-from search.document import Fields, Document
-from search.exceptions import DatabaseLockedException
-from search.query import Condition
+from search.document import Fields, Document, collation_key
+from search.exceptions import DatabaseLockedException, ReadOnlyDatabaseException, InvalidMergePolicyException
+from search import instrumentation
+from search.query import Condition, Range
+from search.database import RANGE_BOUNDS
+from search.compiler import QueryCompiler
+from search.pool import pool
+from search.cache import LRUCache
+from search.schema import compile_schema
 
+from contextlib import contextmanager
+import math
 import os.path
+import time
 from os import makedirs
+from multiprocessing import cpu_count
 from settings.paths import root
 from whoosh import index, sorting
-from whoosh.fields import Schema, TEXT, ID, DATETIME, NUMERIC
+from whoosh.writing import CLEAR
+from whoosh.columns import VarBytesColumn
+from whoosh.fields import Schema, TEXT, ID, DATETIME, NUMERIC, COLUMN
+from whoosh.query import And, Or, Term, Prefix, TermRange, Every, NullQuery, NumericRange, DateRange
 from whoosh.qparser import MultifieldParser, GtLtPlugin, WildcardPlugin, PrefixPlugin, PhrasePlugin, FieldsPlugin
-from whoosh.filedb.filewriting import LockError
+from whoosh.filedb.filestore import FileStorage
+from whoosh.index import FileIndex, TOC, LockError
 
 import sys
 
@@ -18,26 +32,236 @@ class Backend(DatabaseBackend):
     writer        = None
     path          = None
     schema        = None
-    search_fields = []
-    stored_fields = []
+    compiled      = None
+    search_fields = ()
+    stored_fields = ()
     uuid_field    = None
-    sort_fields   = []
+    sort_fields   = frozenset()
+    procs         = 1
+    limitmb       = 128
+    merge         = "default"
+    parser        = None
+    compiler      = None
+    snapshot      = False
+    publish_snapshots = False
+    snapshot_interval = 1.0
 
-    def __init__(self, name, schema, index_dir = ""):
-        self.path   = index_dir + "/" + name
-        self.schema = self.convert_schema(schema)
+    def __init__(self, name, schema, index_dir = "", procs = 1, limitmb = 128, merge = "default",
+                 snapshot = False, publish_snapshots = False, snapshot_interval = 1.0):
+        self.path    = index_dir + "/" + name
+        self.procs   = procs
+        self.limitmb = limitmb
+        if merge not in merge_policies:
+            raise InvalidMergePolicyException("Unknown merge policy %r (%s)" % (merge, ", ".join(sorted(merge_policies))))
+        self.merge   = merge
+        self.snapshot          = snapshot
+        self.publish_snapshots = publish_snapshots
+        self.snapshot_interval = snapshot_interval
+        self.compiled      = compile_schema(type(self), schema, self.convert_schema)
+        self.schema        = self.compiled.schema
+        self.search_fields = self.compiled.search_fields
+        self.stored_fields = self.compiled.stored_fields
+        self.sort_fields   = self.compiled.sort_fields
+        self.uuid_field    = self.compiled.uuid_field
+        self.range_fields  = self.compiled.range_fields
 
     def open(self, write = False):
+        if self.snapshot:
+            if write:
+                raise ReadOnlyDatabaseException
+            with self.current_snapshot() as snapshot:
+                self.index = snapshot.index
+            return
+
         if not self.index:
-            self.check_createdb()
-            self.index = index.open_dir(self.path)
+            self.index = pool.get(("whoosh.index", self.path), self._open_index, ttl = None)
 
         if write and not self.writer:
             try:
-                self.writer = self.index.writer()
+                self.writer = self.index.writer(procs = self.procs, limitmb = self.limitmb)
             except LockError:
+                instrumentation.incr("lock_contention")
                 raise DatabaseLockedException
 
+    def _open_index(self):
+        self.check_createdb()
+        return index.open_dir(self.path)
+
+    """
+    Wypozycza searcher z puli procesu - otwarty raz na indeks i zastepowany
+    nowym, gdy zmieni sie generacja indeksu:
+
+        with self.searcher() as searcher:
+            ...
+    """
+    def searcher(self):
+        if self.snapshot:
+            return self.snapshot_searcher()
+        self.open()
+        return pool.lease(("whoosh.searcher", self.path), self.index.searcher, self._refresh_searcher, self.pool_ttl)
+
+    def warmup(self):
+        with self.searcher():
+            pass
+
+    def index_files(self):
+        self.open()
+        return [os.path.join(self.path, filename) for filename in self.index.storage.list()]
+
+    def generation(self):
+        with self.searcher() as searcher:
+            return searcher.reader().generation()
+
+    def query_cache(self):
+        return pool.get(("whoosh.queries", self.path), lambda: LRUCache(self.query_cache_size), ttl = None)
+
+    def query_parser(self):
+        if self.parser is None:
+            self.open()
+            parser = MultifieldParser(
+                self.search_fields,
+                schema = self.index.schema,
+            )
+            parser.add_plugin(GtLtPlugin())
+            parser.add_plugin(PhrasePlugin())
+            parser.add_plugin(FieldsPlugin())
+            #parser.remove_plugin_class(WildcardPlugin)
+            #parser.add_plugin(WildcardPlugin())
+            parser.add_plugin(PrefixPlugin())
+            self.parser = parser
+        return self.parser
+
+    """
+    Zwraca pare (zapytanie, filtr). Zakresy na polach liczbowych i dat nie
+    przechodza przez parser - sa filtrem NumericRange / DateRange, ktory
+    zaweza zbior dokumentow bez liczenia trafnosci.
+    """
+    def parse(self, query):
+        if self.compile_queries:
+            compiler = self.query_compiler()
+            node = compiler.fold(query)
+            return self.query_cache().get_or_create(node, lambda: compiler.compile(node))
+        query_str, ranges = self.split_ranges(query)
+        return self.query_cache().get_or_create((query_str, ranges), lambda: self._compile(query_str, ranges))
+
+    def _compile(self, query_str, ranges):
+        if ranges and not query_str.strip():
+            parsed = Every()
+        else:
+            parsed = self.query_parser().parse(query_str)
+        if not ranges:
+            return parsed, None
+        return parsed, self.range_filter(ranges)
+
+    def query_compiler(self):
+        if self.compiler is None:
+            self.open()
+            self.compiler = WhooshCompiler(self)
+        return self.compiler
+
+    def range_query(self, _range):
+        range_class = NumericRange
+        if type(self.range_fields[_range.field]) == Fields.DateTimeField:
+            range_class = DateRange
+        return range_class(
+            _range.field, _range.start, _range.end,
+            startexcl = not _range.start_inclusive,
+            endexcl = not _range.end_inclusive
+        )
+
+    def range_filter(self, ranges):
+        if len(ranges) == 1:
+            return self.range_query(ranges[0])
+        return And([self.range_query(_range) for _range in ranges])
+
+    """
+    Nowy searcher zamiast searcher.refresh() - refresh wspoldzieli czesc
+    readerow ze starym i zamyka pozostale, a stary moze byc jeszcze uzywany
+    przez inne watki. Pula zamknie go po ostatnim zwolnieniu.
+    """
+    def _refresh_searcher(self, searcher):
+        if searcher.up_to_date():
+            return searcher
+        return self.index.searcher()
+
+    """
+    Tryb snapshot (params "snapshot": True) - indeks tylko do odczytu,
+    przypiety do opublikowanej generacji. Pliki sa otwierane przez mmap
+    (segmenty whoosha sa domyslnie plikami zlozonymi), bez writera i bez
+    sprawdzania blokad. Strony plikow mapowanych sa wspoldzielone przez
+    procesy w cache stron systemu.
+
+    Snapshot trzeba otwierac w kazdym procesie osobno, po fork (np.
+    search.warmup w hooku post_fork gunicorna, nie w procesie nadrzednym) -
+    pliki otwarte przed fork bez mmap (TOC, segmenty niezlozone) dzielilyby
+    pozycje odczytu pomiedzy workerami.
+
+    Proces zapisujacy z "publish_snapshots": True po kazdym commit zapisuje
+    numer generacji do pliku obok indeksu (atomowo, przez rename). Czytelnicy
+    sprawdzaja go co snapshot_interval sekund i po zmianie otwieraja nowa
+    generacje, a dopiero potem podmieniaja ja w puli - zapytania w toku
+    koncza na starej. Bez pliku (nikt nie publikuje) czytelnicy przechodza
+    na najnowsza generacje indeksu.
+    """
+    def current_snapshot(self):
+        return pool.lease(("whoosh.snapshot", self.path), self._open_snapshot, self._refresh_snapshot, ttl = None)
+
+    @contextmanager
+    def snapshot_searcher(self):
+        with self.current_snapshot() as snapshot:
+            self.index = snapshot.index
+            yield snapshot.searcher
+
+    def _open_snapshot(self, generation = None):
+        storage = FileStorage(self.path, supports_mmap = True, readonly = True)
+        if generation is None:
+            generation = self.published_generation()
+        if generation is not None:
+            try:
+                return Snapshot(SnapshotIndex(storage, generation))
+            except IOError:
+                #TOC lub segmenty opublikowanej generacji usunal juz writer
+                pass
+        return Snapshot(SnapshotIndex(storage))
+
+    def _refresh_snapshot(self, snapshot):
+        now = time.time()
+        if now - snapshot.checked < self.snapshot_interval:
+            return snapshot
+        snapshot.checked = now
+        generation = self.published_generation()
+        if generation is None:
+            generation = snapshot.index.latest_generation()
+        if generation == snapshot.generation:
+            return snapshot
+        return self._open_snapshot(generation)
+
+    def snapshot_path(self):
+        return self.path + ".snapshot"
+
+    def published_generation(self):
+        try:
+            with open(self.snapshot_path()) as fp:
+                return int(fp.read().strip())
+        except (IOError, ValueError):
+            return None
+
+    """
+    Publikuje biezaca generacje indeksu dla czytelnikow w trybie snapshot
+    """
+    def publish(self):
+        self.open()
+        generation = self.index.latest_generation()
+        temp = self.snapshot_path() + ".tmp"
+        with open(temp, "w") as fp:
+            fp.write("%d\n" % generation)
+        os.rename(temp, self.snapshot_path())
+        return generation
+
+    def committed(self):
+        if self.publish_snapshots:
+            self.publish()
+
     def check_createdb(self):
         if not os.path.exists(self.path):
             makedirs(self.path)
@@ -45,78 +269,383 @@ class Backend(DatabaseBackend):
         if not index.exists_in(self.path):
             index.create_in(self.path, schema = self.schema)
 
+    """
+    Zamkniety (po commit lub cancel) writer whoosha nie moze byc uzyty
+    ponownie - kolejny zapis otworzy nowy. Bez zapisow commit nic nie robi.
+    """
     def commit(self):
-        self.writer.commit()
+        if self.writer is None:
+            return
+        self.writer.commit(**merge_policies[self.merge])
+        self.writer = None
+        self.committed()
+
+    """
+    Scala wszystkie segmenty indeksu w jeden. Zwraca liczbe segmentow
+    i rozmiar indeksu na dysku przed i po.
+    """
+    def optimize(self):
+        if self.snapshot:
+            raise ReadOnlyDatabaseException
+        self.open()
+        before = self.index_stats()
+        try:
+            writer = self.index.writer(limitmb = self.limitmb)
+        except LockError:
+            instrumentation.incr("lock_contention")
+            raise DatabaseLockedException
+        writer.commit(optimize = True)
+        self.committed()
+        return {"before": before, "after": self.index_stats()}
+
+    def fingerprint_path(self):
+        return self.path + ".fingerprints"
+
+    def index_stats(self):
+        size = 0
+        for filename in os.listdir(self.path):
+            size += os.path.getsize(os.path.join(self.path, filename))
+        return {
+            "segments": len(TOC.read(self.index.storage, self.index.indexname).segments),
+            "size"    : size,
+        }
 
     def close(self):
-        self.index.close()
+        if self.index is not None:
+            self.index.close()
 
     def add(self, document):
         self.open(True)
-        document = self._prepare_document(document)
+        document = self._prepare_document(document, self.writer.schema)
         self.writer.add_document(**document.data)
 
     def replace(self, uuid, document):
         self.open(True)
-        document = self._prepare_document(document)
+        document = self._prepare_document(document, self.writer.schema)
         self.writer.update_document(**document.data)
 
+    def add_many(self, documents):
+        self.open(True)
+        for document in documents:
+            self.writer.add_document(**self._prepare_document(document, self.writer.schema).data)
+
+    def replace_many(self, documents):
+        self.open(True)
+        for document in documents:
+            self.writer.update_document(**self._prepare_document(document, self.writer.schema).data)
+
+    """
+    Pelna przebudowa indeksu. Dokumenty sa rozdzielane pomiedzy procs procesow,
+    z ktorych kazdy buduje wlasny segment. Na koniec segmenty sa scalane
+    (lub, jesli merge == False, dolaczane bez scalania) i zapisywane w nowym
+    TOC w miejsce wszystkich dotychczasowych segmentow - czytelnicy widza
+    albo stary, albo nowy indeks. Przy okazji pola __isort ze starych
+    indeksow sa zamieniane na kolumny.
+    """
+    def rebuild(self, documents, procs = None, merge = True):
+        if self.snapshot:
+            raise ReadOnlyDatabaseException
+        self.open()
+        self._migrate_sort_columns()
+        try:
+            writer = self.index.writer(
+                procs = procs or cpu_count(),
+                limitmb = self.limitmb,
+                multisegment = not merge
+            )
+        except LockError:
+            instrumentation.incr("lock_contention")
+            raise DatabaseLockedException
+
+        try:
+            for document in documents:
+                writer.add_document(**self._prepare_document(document, writer.schema).data)
+        except:
+            writer.cancel()
+            raise
+
+        writer.commit(mergetype = CLEAR)
+        self.committed()
+
     def remove(self, uuid):
         self.open(True)
         self.writer.delete_by_term(self.uuid_field, uuid)
 
     """
-    Metoda konwertuje schemat bazy z ogolnego do szczegolowego (w tym wypadku whoosha)
+    Metoda konwertuje schemat bazy z ogolnego do szczegolowego (w tym wypadku whoosha).
+    Wynik trafia do CompiledSchema wspoldzielonego przez wszystkie instancje.
     """
     def convert_schema(self, schema):
         parsed_schema = {}
+        uuid_field    = None
+        search_fields = []
+        stored_fields = []
+        sort_fields   = set()
+        range_fields  = {}
 
         for field, field_type in schema.items():
             whoosh_field = TEXT(stored = field_type.store)
             if type(field_type) == Fields.UUIDField:
                 whoosh_field = ID(stored = field_type.store, unique = True)
-                self.uuid_field = field
+                uuid_field = field
             elif type(field_type) == Fields.IntegerField:
                 whoosh_field = NUMERIC(stored = field_type.store)
+            elif type(field_type) == Fields.FloatField:
+                whoosh_field = NUMERIC(float, stored = field_type.store)
+            elif type(field_type) == Fields.DateTimeField:
+                whoosh_field = DATETIME(stored = field_type.store)
             elif type(field_type) == Fields.CharField and field_type.split_to_terms == False:
                 whoosh_field = ID(stored = field_type.store)
+            if field_type.range_filter:
+                range_fields[field] = field_type
             if type(field_type) != Fields.UUIDField:
-                self.search_fields.append(field)
+                search_fields.append(field)
             if field_type.store:
-                self.stored_fields.append(field)
+                stored_fields.append(field)
             if type(field_type) == Fields.CharField and field_type.sort:
-                parsed_schema[field+"__isort"] = ID(stored=False)
-                self.sort_fields.append(field)
+                #tylko kolumna (doc values) - bez termow w indeksie odwroconym
+                parsed_schema[field+"__isort"] = COLUMN(VarBytesColumn())
+                sort_fields.add(field)
             parsed_schema[field] = whoosh_field
 
-        return Schema(**parsed_schema)
+        return {
+            "schema"       : Schema(**parsed_schema),
+            "uuid_field"   : uuid_field,
+            "search_fields": search_fields,
+            "stored_fields": stored_fields,
+            "sort_fields"  : sort_fields,
+            "range_fields" : range_fields,
+        }
 
     def find(self, query, order = None):
         self.open()
         return WhooshSearchResult(self, query, order)
 
+    """
+    Bezposredni odczyt pol przechowywanych po unikalnym polu ID (uuid),
+    bez parsowania zapytania i liczenia trafnosci.
+    """
+    def get_many(self, uuids):
+        out = {}
+        with self.searcher() as searcher:
+            for uuid in uuids:
+                docnum = searcher.document_number(**{self.uuid_field: uuid})
+                if docnum is not None:
+                    out[uuid] = self.stored_data(searcher.stored_fields(docnum))
+        return out
+
+    """
+    Zliczanie bez ladowania pol przechowywanych - kolektor zbiera tylko
+    numery dokumentow (i grupy dla facets), bez liczenia trafnosci.
+    """
+    def count(self, query):
+        parsed, filter = self.parse(query)
+        with self.searcher() as searcher:
+            return len(searcher.search(parsed, filter = filter, limit = None, scored = False))
+
+    def facets(self, query, fields, limit = 100):
+        groupedby = sorting.Facets()
+        for field in fields:
+            groupedby.add_field(field)
+        parsed, filter = self.parse(query)
+        with self.searcher() as searcher:
+            results = searcher.search(
+                parsed,
+                filter = filter,
+                limit = None,
+                scored = False,
+                groupedby = groupedby,
+                maptype = sorting.Count
+            )
+            return {field: self.top_counts(results.groups(field), limit) for field in fields}
+
+    def stored_data(self, stored):
+        return {field: stored.get(field, None) for field in self.stored_fields}
+
     def rollback(self):
-        self.writer.cancel()
-
-    def _prepare_document(self, document):
-        if self.sort_fields:
-            for field in self.sort_fields:
-                sort_content = ""
-                try:
-                    sort_content = document.data[field].replace(" ", "").lower()
-                except:
-                    pass
-                if type(sort_content) == str:
-                    sort_content = unicode(sort_content, "utf-8")
-                document.data[field+"__isort"] = sort_content
+        if self.writer is not None:
+            self.writer.cancel()
+            self.writer = None
+
+    """
+    Klucze sortowania sa zapisywane w formacie pola __isort ze schematu
+    indeksu (schema writera): kolumna VarBytesColumn przyjmuje bajty, a pole
+    ID z indeksow zalozonych przed kolumnami - unicode.
+    """
+    def _prepare_document(self, document, schema):
+        sort_keys = {}
+        for field in self.sort_fields:
+            key = collation_key(document.data.get(field))
+            if isinstance(schema[field+"__isort"], COLUMN):
+                key = key.encode("utf-8")
+            sort_keys[field+"__isort"] = key
         for field, content in document.data.items():
             if type(content) == str or type(content) == unicode and len(content) == 0:
                 document.data[field] = u" "
+        document.data.update(sort_keys)
 
         return document
 
+    """
+    Zamienia w schemacie indeksu pola __isort typu ID (indeksy zalozone
+    przed kolumnami sortowania) na kolumny. Dokumenty zapisane wczesniej
+    nie maja kolumny - wolane przez rebuild(), ktory je zastepuje.
+    """
+    def _migrate_sort_columns(self):
+        stored = self.index.schema
+        outdated = [
+            field+"__isort" for field in self.sort_fields
+            if field+"__isort" in stored and not isinstance(stored[field+"__isort"], COLUMN)
+        ]
+        if not outdated:
+            return
+        try:
+            writer = self.index.writer()
+        except LockError:
+            instrumentation.incr("lock_contention")
+            raise DatabaseLockedException
+        for name in outdated:
+            writer.remove_field(name)
+            writer.add_field(name, self.schema[name])
+        writer.commit(merge = False)
+
+
+class WhooshCompiler(QueryCompiler):
+    """
+    Buduje zapytania whoosha (And / Or / Term / Prefix / zakresy) wprost
+    z AST. Tekst warunku jest dzielony na termy analizatorem pola, tak jak
+    zrobilby to parser.
+    """
+    def emit_all(self):
+        return Every()
+
+    def emit_none(self):
+        return NullQuery
+
+    def emit_and(self, queries):
+        return And(queries)
+
+    def emit_or(self, queries):
+        return Or(queries)
+
+    def emit_range(self, _range):
+        return self.engine.range_query(_range)
+
+    def emit_filter(self, ranges):
+        return self.engine.range_filter(ranges)
+
+    def emit_raw(self, text):
+        return self.engine.query_parser().parse(text)
+
+    def emit_condition(self, field, operator, value):
+        if field in self.engine.range_fields:
+            return self.engine.range_query(Range(field, value, True, value, True))
+
+        if type(value) == str:
+            value = unicode(value, "utf-8")
+        elif type(value) != unicode:
+            value = unicode(value)
+
+        if operator != Condition.OPERATOR_CONTAINS:
+            bound, inclusive = RANGE_BOUNDS[operator]
+            if bound == "start":
+                return TermRange(field, value, None, startexcl = not inclusive)
+            return TermRange(field, None, value, endexcl = not inclusive)
+
+        prefix = value.rstrip().endswith("*")
+        value = value.rstrip().rstrip("*")
+        field_type = self.engine.schema[field]
+        if isinstance(field_type, ID):
+            return Prefix(field, value) if prefix else Term(field, value)
+
+        words = list(field_type.process_text(value, mode = "query"))
+        if not words:
+            return NullQuery
+        queries = [Term(field, word) for word in words]
+        if prefix:
+            queries[-1] = Prefix(field, words[-1])
+        if len(queries) == 1:
+            return queries[0]
+        return And(queries)
+
+
+"""
+Polityka scalania "tiered": segmenty sa grupowane wedlug rzedu wielkosci
+liczby dokumentow i scalane dopiero, gdy w jednej grupie zbierze sie
+TIER_SIZE segmentow - male commity nie przepisuja za kazdym razem duzych
+segmentow.
+"""
+TIER_SIZE = 10
+
+def TIERED_MERGE(writer, segments):
+    from whoosh.reading import SegmentReader
+
+    tiers = {}
+    for segment in segments:
+        tier = int(math.log10(max(segment.doc_count_all(), 1)))
+        tiers.setdefault(tier, []).append(segment)
+
+    unchanged = []
+    for tier, tier_segments in tiers.items():
+        if len(tier_segments) < TIER_SIZE:
+            unchanged.extend(tier_segments)
+            continue
+        for segment in tier_segments:
+            reader = SegmentReader(writer.storage, writer.schema, segment)
+            writer.add_reader(reader)
+            reader.close()
+    return unchanged
+
+class SnapshotIndex(FileIndex):
+    """
+    Indeks przypiety do jednej generacji - reader() i searcher() otwieraja
+    ja nawet wtedy, gdy writer zapisal juz nowsze. Bez generacji - najnowsza
+    w chwili otwarcia.
+    """
+    def __init__(self, storage, generation = None):
+        FileIndex.__init__(self, storage)
+        if generation is None:
+            generation = self.latest_generation()
+        self.generation = generation
+        TOC.read(self.storage, self.indexname, gen = generation)
+
+    def _read_toc(self):
+        return TOC.read(self.storage, self.indexname, gen = self.generation)
+
+    #bez ponawiania z FileIndex.reader - usunieta generacja sie nie pojawi
+    def reader(self, reuse = None):
+        info = self._read_toc()
+        return self._reader(self.storage, info.schema, info.segments, info.generation, reuse = reuse)
+
+
+class Snapshot(object):
+    """
+    Otwarta generacja indeksu w puli procesu. Zastapiony snapshot jest
+    zamykany przez pule, gdy zwolni go ostatnie zapytanie w toku.
+    """
+    def __init__(self, index):
+        self.index      = index
+        self.generation = index.generation
+        self.searcher   = index.searcher()
+        self.checked    = time.time()
+
+    def close(self):
+        self.searcher.close()
+
+
+merge_policies = {
+    "default" : {},
+    "none"    : {"merge": False},
+    "tiered"  : {"mergetype": TIERED_MERGE},
+    "optimize": {"optimize": True},
+}
+
 
 class WhooshSearchResult(SearchResult):
+    _searcher       = None
+    _cursor_results = None
+    _parsed         = None
+
     def __init__(self, engine, query, order):
         self.query  = query
         self.engine = engine
@@ -129,36 +658,48 @@ class WhooshSearchResult(SearchResult):
                     order_field = field + "__isort"
                 self.order.add_field(order_field, reverse = (sort_order == "desc"))
 
-    def page(self, page, limit):
-        with self.engine.index.searcher() as searcher:
-            parser = MultifieldParser(
-                self.engine.search_fields,
-                schema = self.engine.index.schema,
-            )
-            parser.add_plugin(GtLtPlugin())
-            parser.add_plugin(PhrasePlugin())
-            parser.add_plugin(FieldsPlugin())
-            #parser.remove_plugin_class(WildcardPlugin)
-            #parser.add_plugin(WildcardPlugin())
-            parser.add_plugin(PrefixPlugin())
+    def parse(self):
+        if self._parsed is None:
+            with instrumentation.timer("parse"):
+                self._parsed = self.engine.parse(self.query)
+        return self._parsed
 
-            whoosh_query = parser.parse(self.query.toString(self.engine))
-            #print "============" + str(whoosh_query)
-            results = searcher.search_page(whoosh_query, page, limit, sortedby = self.order)
-            self.rows = results.total
+    def _stored(self, start, limit):
+        parsed, filter = self.parse()
+        with self.engine.searcher() as searcher:
+            with instrumentation.timer("search"):
+                results = searcher.search(parsed, filter = filter, limit = start + limit, sortedby = self.order)
+            self.rows = len(results)
+            with instrumentation.timer("load"):
+                return [result.fields() for result in results[start:start + limit]]
 
-            _results = []
-
-            doc_class = self.engine.database.document
+    """
+    Kursor to pozycja w posortowanej liscie trafien tego obiektu. Lista
+    numerow wszystkich trafien jest wyliczana raz (limit = None), na jednym
+    otwartym searcherze, wiec kolejne strony nie powtarzaja wyszukiwania i
+    nie widza pozniejszych zmian indeksu. Searcher jest zwalniany w free().
+    """
+    def _after(self, cursor, limit):
+        if self._cursor_results is None:
+            self._searcher = self.engine.index.searcher()
+            parsed, filter = self.parse()
+            self._cursor_results = self._searcher.search(parsed, filter = filter, limit = None, sortedby = self.order)
+            self.rows = len(self._cursor_results)
 
-            for result in results:
-                doc = doc_class(data = {field: result.get(field, None) for field in self.engine.stored_fields}, restore = True)
-                _results.append(doc)
+        start = cursor or 0
+        hits = [self.engine.stored_data(result) for result in self._cursor_results[start:start + limit]]
+        if start + limit >= self.rows:
+            return hits, None
+        return hits, start + limit
 
-        return _results
+    def free(self):
+        self._cursor_results = None
+        if self._searcher is not None:
+            self._searcher.close()
+            self._searcher = None
 
     def __enter__(self):
         return self
 
     def __exit__(self, *args, **kwargs):
-        pass
+        self.free()
@@ -1,43 +1,162 @@
-from search.database import DatabaseBackend, SearchResult
-from search.document import Fields
-from search.query import Condition
-from search.exceptions import DatabaseLockedException
+from search.database import DatabaseBackend, SearchResult, RANGE_BOUNDS
+from search.document import Fields, collation_key
+from search.query import Condition, Range
+from search.compiler import QueryCompiler
+from search.exceptions import DatabaseLockedException, InvalidFieldException
+from search import instrumentation
+from search.pool import pool
+from search.cache import LRUCache
+from search.schema import compile_schema
+from collections import namedtuple
+from contextlib import contextmanager
+import calendar
+import datetime
 import os.path
 from os import makedirs
+import sys
+import threading
 import xappy
 
+"""
+Skompilowane zapytanie: czesc tekstowa dla query_parse oraz krotka zakresow
+(Range) nakladanych jako filtry. Obiekt jest niezmienny i nie zalezy od
+stanu backendu, wiec moze byc uzywany z wielu watkow.
+"""
+CompiledQuery = namedtuple("CompiledQuery", ["text", "ranges"])
+
+
+def timestamp(value):
+    return calendar.timegm(value.utctimetuple())
+
+
+class _RangeInText(Exception):
+    pass
+
+
+def range_field_required(field):
+    return InvalidFieldException(
+        "Range condition on %s - xapian can only filter ranges of numeric and date fields" % field
+    )
+
 
 class Backend(DatabaseBackend):
     connection    = None
     path          = None
     schema        = None
-    ranges        = {}
+    compiled      = None
     mappings      = {}
-    values        = []
-    sort_fields   = []
+    values        = ()
+    sort_fields   = frozenset()
+    integer_fields= frozenset()
+    float_fields  = frozenset()
+    date_fields   = frozenset()
+    compiler      = None
 
     def __init__(self, name, schema, index_dir = ""):
         self.path   = index_dir + "/" + name
         self.schema = schema
-
+        self.local  = threading.local()
+        self.compiled       = compile_schema(type(self), schema, self.convert_schema)
+        self.mappings       = self.compiled.mappings
+        self.values         = self.compiled.values
+        self.sort_fields    = self.compiled.sort_fields
+        self.integer_fields = self.compiled.integer_fields
+        self.float_fields   = self.compiled.float_fields
+        self.date_fields    = self.compiled.date_fields
+        self.range_fields   = self.compiled.range_fields
+
+    """
+    open(True) otwiera polaczenie zapisujace tej instancji. Do wyszukiwania
+    sluzy reader() - polaczenie wypozyczane z puli na wylacznosc na czas
+    jednej operacji, wiec jedna instancja backendu moze obslugiwac wiele
+    watkow naraz.
+    """
     def open(self, write = False):
-        if not self.connection:
-            if write:
-                try:
-                    self.check_createdb()
-                    self.connection = xappy.IndexerConnection(self.path)
-                    self.prepare_schema()
-                except xappy.XapianDatabaseLockError:
-                    raise DatabaseLockedException
-            else:
-                self.connection = xappy.SearchConnection(self.path)
+        if write and not self.connection:
+            try:
+                self.check_createdb()
+                self.connection = xappy.IndexerConnection(self.path)
+                self.prepare_schema()
+            except xappy.XapianDatabaseLockError:
+                instrumentation.incr("lock_contention")
+                raise DatabaseLockedException
+
+    """
+    Wypozycza polaczenie do odczytu. Polaczenia sa wspolne dla procesu -
+    kazde wypozyczane na wylacznosc, wolne dostaje dowolny watek. Zagniezdzone
+    wywolania w tym samym watku (np. budowanie zapytania w trakcie
+    wyszukiwania) dostaja to samo polaczenie - wewnatrz bloku jest ono tez
+    zwracane przez current_reader().
+    """
+    @contextmanager
+    def reader(self):
+        current = getattr(self.local, "reader", None)
+        if current is not None:
+            yield current
+            return
+        lease = pool.lease(
+            ("xapian", self.path),
+            self.connect,
+            self._refresh_connection,
+            self.pool_ttl,
+            shared = False
+        )
+        with lease as connection:
+            self.local.reader = connection
+            try:
+                yield connection
+            finally:
+                self.local.reader = None
+
+    def current_reader(self):
+        return self.local.reader
+
+    def connect(self):
+        connection = xappy.SearchConnection(self.path)
+        connection.search_queries = LRUCache(self.query_cache_size)
+        return connection
+
+    """
+    reopen() przelacza polaczenie na najnowsza wersje bazy - polaczenie jest
+    wtedy wypozyczone na wylacznosc
+    """
+    def _refresh_connection(self, connection):
+        connection.reopen()
+        return connection
 
     def check_createdb(self):
         if not os.path.exists(self.path):
             makedirs(self.path)
 
+    def warmup(self):
+        with self.reader():
+            pass
+
+    def index_files(self):
+        if not os.path.exists(self.path):
+            return []
+        return [
+            os.path.join(self.path, filename) for filename in os.listdir(self.path)
+            if os.path.isfile(os.path.join(self.path, filename))
+        ]
+
+    """
+    Rewizja bazy xapiana (Database.get_revision, od xapiana 1.4) po reopen()
+    wypozyczanego polaczenia - starsze wersje jej nie udostepniaja.
+    """
+    def generation(self):
+        with self.reader() as connection:
+            get_revision = getattr(connection._index, "get_revision", None)
+            if get_revision is None:
+                return None
+            return get_revision()
+
     def commit(self):
-        self.connection.flush()
+        if self.connection:
+            self.connection.flush()
+
+    def fingerprint_path(self):
+        return self.path + ".fingerprints"
 
     def close(self):
         if self.connection:
@@ -54,55 +173,242 @@ class Backend(DatabaseBackend):
         self.open(True)
         self.connection.replace(self._prepare_document(document))
 
+    def add_many(self, documents):
+        self.open(True)
+        for document in documents:
+            self.connection.add(self.connection.process(self._prepare_document(document)))
+        self.connection.flush()
+
+    def replace_many(self, documents):
+        self.open(True)
+        for document in documents:
+            self.connection.replace(self._prepare_document(document))
+        self.connection.flush()
+
     def remove(self, uuid):
         self.open(True)
         self.connection.delete(uuid)
 
 
+    def convert_schema(self, schema):
+        mappings       = {}
+        values         = []
+        sort_fields    = set()
+        integer_fields = set()
+        float_fields   = set()
+        date_fields    = set()
+        range_fields   = {}
+
+        for field, field_type in schema.items():
+            if type(field_type) == Fields.IntegerField:
+                mappings[field] = str
+                values.append(field)
+                integer_fields.add(field)
+            elif type(field_type) == Fields.FloatField:
+                mappings[field] = repr
+                values.append(field)
+                float_fields.add(field)
+            elif type(field_type) == Fields.DateTimeField:
+                #daty sa przechowywane jako znacznik czasu UTC - wartosc "float"
+                mappings[field] = lambda value: str(timestamp(value))
+                values.append(field)
+                date_fields.add(field)
+            elif type(field_type) == Fields.CharField and field_type.sort:
+                sort_fields.add(field)
+            if field_type.range_filter:
+                range_fields[field] = field_type
+
+        return {
+            "mappings"      : mappings,
+            "values"        : values,
+            "sort_fields"   : sort_fields,
+            "integer_fields": integer_fields,
+            "float_fields"  : float_fields,
+            "date_fields"   : date_fields,
+            "range_fields"  : range_fields,
+        }
+
     def prepare_schema(self):
         for field, field_type in self.schema.items():
             sort_type = None
+            sort = field_type.sort
             if type(field_type) == Fields.IntegerField:
                 sort_type = "float"
-                field_type.sort = True
+                sort = True
                 self.connection.add_field_action(field, xappy.FieldActions.INDEX_EXACT)
-                self.mappings[field] = str
-                self.values.append(field)
+                self.connection.add_field_action(field, xappy.FieldActions.TAG)
+            elif type(field_type) in (Fields.FloatField, Fields.DateTimeField):
+                sort_type = "float"
+                sort = True
             elif type(field_type) == Fields.UUIDField:
                 self.connection.add_field_action(field, xappy.FieldActions.INDEX_EXACT)
             elif type(field_type) == Fields.CharField:
                 self.connection.add_field_action(field, xappy.FieldActions.INDEX_FREETEXT)
+                if not field_type.split_to_terms:
+                    self.connection.add_field_action(field, xappy.FieldActions.TAG)
                 if field_type.sort:
-                    self.sort_fields.append(field)
-                    self.connection.add_field_action(field+"__isort", xappy.FieldActions.INDEX_FREETEXT)
+                    #tylko wartosc w slocie (bez termow) - klucz jest gotowy
                     self.connection.add_field_action(field+"__isort", xappy.FieldActions.SORTABLE, type="string")
             if field_type.store:
                 self.connection.add_field_action(field, xappy.FieldActions.STORE_CONTENT)
-            if field_type.sort:
+            if sort:
                 self.connection.add_field_action(field, xappy.FieldActions.SORTABLE, type = sort_type)
 
     def get_sort_fields(self):
-        if not self.sort_fields:
-            for field, field_type in self.schema.items():
-                if type(field_type) == Fields.CharField and field_type.sort:
-                    self.sort_fields.append(field)
         return self.sort_fields
 
     def find(self, query, order = None):
-        self.open()
         return XapianSearchResult(self, query, order)
 
+    def get_many(self, uuids):
+        out = {}
+        with self.reader() as connection:
+            for uuid in uuids:
+                try:
+                    out[uuid] = self.stored_data(connection.get_document(uuid).data)
+                except KeyError:
+                    pass
+        return out
+
+    """
+    checkatleast = -1 wymusza sprawdzenie wszystkich dopasowan, wiec liczba
+    trafien jest dokladna. Wartosci faset zlicza match spy pol TAG.
+    """
+    def count(self, query):
+        with self.reader() as connection:
+            return connection.search(self.parse(query), 0, 0, checkatleast = -1).matches_estimated
+
+    def facets(self, query, fields, limit = 100):
+        out = {}
+        with self.reader() as connection:
+            search_result = connection.search(self.parse(query), 0, 0, checkatleast = -1, gettags = fields)
+            for field in fields:
+                counts = search_result.get_top_tags(field, limit if limit is not None else sys.maxint)
+                if field in self.integer_fields:
+                    counts = [(int(value), count) for value, count in counts]
+                out[field] = dict(counts)
+        return out
+
+    def stored_data(self, stored):
+        data = {}
+        for field in stored:
+            data[field] = self.stored_value(stored, field)
+        return data
+
+    """
+    xappy przechowuje kazde pole jako liste wartosci - laczenie i konwersja
+    do int odbywa sie dopiero przy odczycie pola.
+    """
+    def stored_value(self, stored, field):
+        values = stored.get(field)
+        if values is None:
+            return None
+        if field in self.integer_fields:
+            return int(values[0])
+        if field in self.float_fields:
+            return float(values[0])
+        if field in self.date_fields:
+            return datetime.datetime.utcfromtimestamp(float(values[0]))
+        return " ".join(values)
+
+    """
+    Polaczenia xapiana (i zbudowane na nich zapytania) nie sa bezpieczne
+    watkowo, dlatego cache zapytan nalezy do polaczenia z puli procesu i jest
+    uzywany tylko przez watek, ktory je wypozyczyl. Zapytania zbudowane w
+    innym watku (np. warmup) zostaja w wolnym polaczeniu, ktore dostana potem
+    watki obslugujace zapytania.
+    """
+    def query_cache(self):
+        with self.reader() as connection:
+            return connection.search_queries
+
+    def compile(self, query):
+        return CompiledQuery(*self.split_ranges(query))
+
+    """
+    Zwraca zapytanie xapiana - bez modyfikowania stanu backendu. Zapytanie
+    jest zwiazane z polaczeniem, na ktorym powstalo, wiec wolno go uzyc
+    tylko w tym samym bloku reader().
+    """
+    def parse(self, query):
+        return self.build(self.prepare(query))
+
+    """
+    Przygotowuje zapytanie bez polaczenia: CompiledQuery (tekst i zakresy)
+    albo AST kompilatora. Zapytania z zakresami, ktore nie moga byc filtrem
+    (np. wewnatrz OR), zawsze przechodza przez kompilator - query_parse nie
+    obsluguje zakresow. Wynik mozna przechowywac i uzywac z wielu watkow.
+    """
+    def prepare(self, query):
+        if not self.compile_queries:
+            try:
+                return self.compile(query)
+            except _RangeInText:
+                pass
+        return self.query_compiler().fold(query)
+
+    """
+    Buduje (albo bierze z cache polaczenia) zapytanie xapiana dla wyniku
+    prepare() na polaczeniu wypozyczonym przez biezacy watek.
+    """
+    def build(self, prepared):
+        with instrumentation.timer("parse"), self.reader():
+            if isinstance(prepared, CompiledQuery):
+                return self.query_cache().get_or_create(prepared, lambda: self._compile(prepared.text, prepared.ranges))
+            return self.query_cache().get_or_create(prepared, lambda: self._filter(*self.query_compiler().compile(prepared)))
+
+    def _compile(self, query_str, ranges):
+        connection = self.current_reader()
+        query = connection.query_parse(query_str, allow_wildcards=True)
+
+        if ranges:
+            if not len(query_str.strip()):
+                query = connection.query_all()
+            for _range in ranges:
+                query = connection.query_filter(query, self.range_query(_range))
+        return query
+
+    def _filter(self, query, filter):
+        if filter is None:
+            return query
+        return self.current_reader().query_filter(query, filter)
+
+    def query_compiler(self):
+        if self.compiler is None:
+            self.compiler = XapianCompiler(self)
+        return self.compiler
+
+    """
+    query_range ma zawsze domkniete granice. Dla liczb calkowitych granica
+    otwarta jest przesuwana o 1, dla pozostalych wartosci jej punkt jest
+    wykluczany filtrem.
+    """
+    def range_query(self, _range):
+        connection = self.current_reader()
+        field, start, end = _range.field, _range.start, _range.end
+        if field in self.date_fields:
+            start = timestamp(start) if start is not None else None
+            end = timestamp(end) if end is not None else None
+        if field in self.integer_fields:
+            if start is not None and not _range.start_inclusive:
+                start += 1
+            if end is not None and not _range.end_inclusive:
+                end -= 1
+            return connection.query_range(field, start, end)
+
+        query = connection.query_range(field, start, end)
+        for bound, inclusive in ((start, _range.start_inclusive), (end, _range.end_inclusive)):
+            if bound is not None and not inclusive:
+                query = connection.query_filter(query, connection.query_range(field, bound, bound), exclude = True)
+        return query
+
     def _prepare_document(self, document):
         doc = xappy.UnprocessedDocument()
         for field, content in document.data.items():
             if field in self.mappings:
                 content = self.mappings[field](content)
             if field in self.sort_fields:
-                try:
-                    sort_content = content.replace(" ", "").lower()
-                except:
-                    sort_content = ""
-                doc.fields.append(xappy.Field(field+"__isort", sort_content))
+                doc.fields.append(xappy.Field(field+"__isort", collation_key(content)))
             doc.fields.append(xappy.Field(field, content))
 
         if document.is_uuid_present:
@@ -110,47 +416,66 @@ class Backend(DatabaseBackend):
 
         return doc
 
+    """
+    Warunki zakresowe nie moga trafic do tekstu zapytania - query_parse ich
+    nie obsluguje. Zakresy wyciagniete przez split_ranges w ogole tu nie
+    docieraja, pozostale (np. wewnatrz OR) przelaczaja parse() na kompilator.
+    Zakres na polu bez wartosci jest bledem.
+    """
     def parseQueryCondition(self, condition):
-        if condition.operator in [
-            Condition.OPERATOR_LESS_THAN, Condition.OPERATOR_LESS_EQUAL
-        ]:
-            if condition.field not in self.ranges:
-                self.ranges[condition.field] = {}
-            self.ranges[condition.field]["end"] = condition.value
-
-            return None
-            return "%s:..%s" % (condition.field, condition.value)
-        elif condition.operator in [
-            Condition.OPERATOR_GREATER_THAN, Condition.OPERATOR_GREATER_EQUAL
-        ]:
-            if condition.field not in self.ranges:
-                self.ranges[condition.field] = {}
-            self.ranges[condition.field]["start"] = condition.value
-
-            return None
-            return "%s:%s.." % (condition.field, condition.value)
-        else:
-            return super(Backend, self).parseQueryCondition(condition)
+        if condition.operator in RANGE_BOUNDS:
+            if condition.field not in self.range_fields:
+                raise range_field_required(condition.field)
+            raise _RangeInText
+        return super(Backend, self).parseQueryCondition(condition)
+
+class XapianCompiler(QueryCompiler):
+    """
+    Buduje zapytania xapiana z AST przez query_composite / query_field /
+    query_range polaczenia wypozyczonego na czas parse(). Tylko warunki
+    z wieloznacznikiem (*) przechodza przez query_parse.
+    """
+    def emit_all(self):
+        return self.engine.current_reader().query_all()
+
+    def emit_none(self):
+        return self.engine.current_reader().query_none()
+
+    def emit_and(self, queries):
+        return self.engine.current_reader().query_composite(xappy.SearchConnection.OP_AND, queries)
+
+    def emit_or(self, queries):
+        return self.engine.current_reader().query_composite(xappy.SearchConnection.OP_OR, queries)
+
+    def emit_range(self, _range):
+        return self.engine.range_query(_range)
+
+    def emit_filter(self, ranges):
+        if len(ranges) == 1:
+            return self.engine.range_query(ranges[0])
+        return self.emit_and([self.engine.range_query(_range) for _range in ranges])
+
+    def emit_raw(self, text):
+        return self.engine.current_reader().query_parse(text, allow_wildcards = True)
+
+    def emit_condition(self, field, operator, value):
+        connection = self.engine.current_reader()
+        if field in self.engine.range_fields:
+            return self.engine.range_query(Range(field, value, True, value, True))
+        if operator != Condition.OPERATOR_CONTAINS:
+            raise range_field_required(field)
+        if value.rstrip().endswith("*"):
+            return connection.query_parse(u"%s:%s" % (field, value), allow_wildcards = True)
+        return connection.query_field(field, value)
 
 class XapianSearchResult(SearchResult):
+    """
+    Przechowuje tylko przygotowane zapytanie (prepare) - zapytanie xapiana
+    jest budowane przy kazdym odczycie na wypozyczonym wtedy polaczeniu,
+    bo kolejne strony moga trafic na inne polaczenie (i inny watek).
+    """
     def __init__(self, engine, query, order, order_case_insensitive=True):
-        engine.ranges = {}
-        query = query.toString(engine)
-
-        self.query = engine.connection.query_parse(query, allow_wildcards=True)
-
-        if engine.ranges:
-            if not len(query.strip()):
-                self.query = engine.connection.query_all()
-            for field, _range in engine.ranges.items():
-                self.query = engine.connection.query_filter(
-                    self.query,
-                    engine.connection.query_range(
-                        field,
-                        _range.get("start"),
-                        _range.get("end")
-                    )
-                )
+        self.query = engine.prepare(query)
         self.engine = engine
         self.order = None
         if order:
@@ -163,34 +488,21 @@ class XapianSearchResult(SearchResult):
                     order_str = "-" + order_str
                 self.order.append(order_str)
 
-    def page(self, page, limit):
-        _results = []
-
-        range_start = (page - 1) * limit
-        range_end   = range_start + limit
-
-        search_result = self.engine.connection.search(
-            self.query,
-            range_start,
-            range_end,
-            sortby=self.order
-        )
-
-        self.rows = search_result.matches_estimated
-
-        doc_class = self.engine.database.document
-
-        for result in search_result:
-            data = {}
-            for field, values in result.data.items():
-                if type(self.engine.schema[field]) == Fields.IntegerField:
-                    data[field] = int(values[0])
-                else:
-                    data[field] = " ".join(values)
+    def _stored(self, start, limit):
+        with self.engine.reader() as connection:
+            query = self.engine.build(self.query)
+            with instrumentation.timer("search"):
+                search_result = connection.search(
+                    query,
+                    start,
+                    start + limit,
+                    sortby=self.order
+                )
 
-            _results.append(doc_class(data, restore=True))
+            self.rows = search_result.matches_estimated
 
-        return _results
+            with instrumentation.timer("load"):
+                return [result.data for result in search_result]
 
     def __enter__(self):
         return self
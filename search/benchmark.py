@@ -0,0 +1,319 @@
+"""
+Benchmark dla backendow wyszukiwarki.
+
+Uruchamia Database.add, commit, find + page i get na sztucznym korpusie
+zadanej wielkosci oraz mieszance zapytan budowanych z Query / OR i wypisuje
+opoznienia (p50 / p99), przepustowosc i szczytowe RSS procesu dla kazdego
+backendu. Kazdy backend, wielkosc korpusu i tryb zapytan jest mierzony
+w osobnym procesie (--in-process), bo ru_maxrss to szczyt calego procesu -
+kolejne przebiegi w jednym procesie pokazywalyby szczyt poprzednich.
+Elasticsearch jest mierzony na atrapie polaczenia (MockES), wiec wynik
+obejmuje tylko koszt po stronie klienta.
+
+--compiler both porownuje sciezke tekstowa (Query.toString + parser backendu)
+z kompilatorem zapytan (search.compiler); "parse" to czas budowy zapytania
+backendu z pominieciem cache zapytan.
+
+    python -m search.benchmark --engines memory,whoosh --sizes 1000,10000
+    python -m search.benchmark --engines whoosh,xapian --compiler both
+"""
+from search.document import Document, Fields
+from search.query import Query, OR
+
+from optparse import OptionParser, SUPPRESS_HELP
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+WORDS = [
+    u"red", u"green", u"blue", u"black", u"white", u"small", u"large", u"heavy",
+    u"light", u"cheap", u"premium", u"classic", u"modern", u"steel", u"wooden",
+    u"glass", u"lamp", u"table", u"chair", u"shelf", u"desk", u"sofa", u"bed",
+    u"mirror", u"rug", u"clock", u"vase", u"frame", u"stool", u"bench",
+]
+CATEGORIES = [u"furniture", u"lighting", u"decor", u"outdoor", u"office"]
+
+#kod wyjscia procesu pomiaru, gdy backend nie jest zainstalowany
+SKIPPED = 3
+
+
+class BenchmarkDocument(Document):
+    pass
+
+
+def database_class():
+    from search.database import Database
+
+    class BenchmarkDatabase(Database):
+        prefix   = "benchmark"
+        document = BenchmarkDocument
+        schema   = {
+            "uuid"       : Fields.UUIDField(store = True),
+            "title"      : Fields.CharField(store = True, analyze = True, sort = True),
+            "description": Fields.CharField(store = True, analyze = True),
+            "category"   : Fields.CharField(store = True, split_to_terms = False),
+            "price"      : Fields.IntegerField(store = True),
+        }
+
+    return BenchmarkDatabase
+
+
+class MockES(object):
+    """
+    Atrapa polaczenia pyes.ES. Przechowuje dokumenty w slowniku i na kazde
+    zapytanie odpowiada kolejnymi dokumentami - nie interpretuje zapytan,
+    sluzy do zmierzenia narzutu backendu elasticsearch.
+    """
+    def __init__(self):
+        self.documents = {}
+
+    def open_index(self, name):
+        pass
+
+    def create_index(self, name):
+        pass
+
+    def put_mapping(self, doc_type, mapping, indices = None):
+        pass
+
+    def index(self, doc, index, doc_type, id = None, bulk = False):
+        self.documents[id] = dict(doc)
+
+    def delete(self, index, doc_type, id):
+        self.documents.pop(id, None)
+
+    def flush_bulk(self, forced = False):
+        pass
+
+    def refresh(self, indices = None):
+        pass
+
+    def search_raw(self, search, indices = None, **params):
+        start = getattr(search, "start", 0) or 0
+        size = getattr(search, "size", 10) or 0
+        return MockESResult(list(self.documents.values()), start, size)
+
+    def search_scroll(self, scroll_id, scroll = None):
+        return MockESResult([], 0, 0)
+
+    def count(self, query, indices = None):
+        return {"count": len(self.documents)}
+
+    def mget(self, ids, index = None, doc_type = None):
+        return [MockESModel(id, self.documents.get(id)) for id in ids]
+
+
+class MockESResult(dict):
+    def __init__(self, documents, start, size):
+        hits = [{"_source": document} for document in documents[start:start + size]]
+        dict.__init__(self, hits = {"total": len(documents), "hits": hits}, _scroll_id = "mock")
+
+
+class MockESModel(dict):
+    """
+    Jak pyes.models.ElasticSearchModel - pola dokumentu, metadane w _meta
+    """
+    def __init__(self, id, source):
+        dict.__init__(self, source or {})
+        self._meta = {"id": id, "exists": source is not None}
+
+
+def corpus(size, seed = 0):
+    rnd = random.Random(seed)
+    for i in range(size):
+        yield BenchmarkDocument({
+            "uuid"       : u"doc-%08d" % i,
+            "title"      : u" ".join(rnd.sample(WORDS, 3)),
+            "description": u" ".join(rnd.choice(WORDS) for _ in range(20)),
+            "category"   : rnd.choice(CATEGORIES),
+            "price"      : rnd.randint(1, 1000),
+        })
+
+
+def query_mix(count, seed = 1):
+    rnd = random.Random(seed)
+    queries = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            query = Query(title = rnd.choice(WORDS))
+        elif kind == 1:
+            low = rnd.randint(1, 900)
+            query = Query(price__ge = low, price__lt = low + 100)
+        elif kind == 2:
+            query = OR(Query(title = rnd.choice(WORDS)), Query(description = rnd.choice(WORDS)))
+        else:
+            query = Query(
+                OR(Query(category = rnd.choice(CATEGORIES)), Query(category = rnd.choice(CATEGORIES))),
+                title = rnd.choice(WORDS)
+            )
+        order = None
+        if rnd.random() < 0.5:
+            order = {"title": rnd.choice(["asc", "desc"])}
+        queries.append((query, order))
+    return queries
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / (1024.0 * 1024.0)
+    return rss / 1024.0
+
+
+class Timer(object):
+    def __init__(self):
+        self.samples = []
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.samples.append(time.time() - self.started)
+
+    def report(self, name):
+        total = sum(self.samples)
+        rate = len(self.samples) / total if total else 0.0
+        return "  %-8s n=%-7d p50=%8.3fms p99=%8.3fms %10.1f ops/sec" % (
+            name, len(self.samples),
+            percentile(self.samples, 50) * 1000, percentile(self.samples, 99) * 1000, rate
+        )
+
+
+def run(engine, size, queries, page_size = 20, mock_es = False, compile_queries = False):
+    database = database_class()("size%d%s" % (size, "compiled" if compile_queries else ""), engine)
+    database.engine.compile_queries = compile_queries
+    if mock_es:
+        database.engine.connection = MockES()
+
+    names = ["add", "commit", "parse", "find", "page", "get"]
+    timers = dict((name, Timer()) for name in names)
+    uuids = []
+    for document in corpus(size):
+        with timers["add"]:
+            database.add(document)
+        uuids.append(document.get_uuid())
+    with timers["commit"]:
+        database.commit()
+
+    query_cache = database.engine.query_cache()
+    if query_cache is not None:
+        for query, order in queries:
+            query_cache.clear()
+            with timers["parse"]:
+                database.engine.parse(query)
+        query_cache.clear()
+
+    for query, order in queries:
+        with timers["find"]:
+            result = database.find(query, order)
+        with timers["page"]:
+            result.page(1, page_size)
+        result.free()
+
+    rnd = random.Random(2)
+    for i in range(len(queries)):
+        with timers["get"]:
+            database.get(Query(uuid = rnd.choice(uuids)))
+
+    database.close()
+
+    print("%s%s, %d documents" % (engine, " (compiled)" if compile_queries else "", size))
+    for name in names:
+        if timers[name].samples:
+            print(timers[name].report(name))
+    print("  peak rss %.1f MB" % peak_rss_mb())
+
+
+def configure(engines, index_dir):
+    from django.conf import settings
+
+    search = {
+        "memory"       : {"backend": "search.backends.memory.Backend"},
+        "whoosh"       : {"backend": "search.backends.whoosh.Backend", "params": {"index_dir": index_dir}},
+        "xapian"       : {"backend": "search.backends.xapian.Backend", "params": {"index_dir": index_dir}},
+        "elasticsearch": {"backend": "search.backends.elasticsearch.Backend", "params": {"hosts": ["mock"]}},
+    }
+    if not settings.configured:
+        settings.configure(SEARCH = search)
+    elif hasattr(settings, "SEARCH"):
+        for engine in engines:
+            settings.SEARCH.setdefault(engine, search.get(engine))
+
+
+def main(argv = None):
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("--engines", default = "memory", help = "comma separated engines from settings.SEARCH")
+    parser.add_option("--sizes", default = "1000,10000", help = "comma separated corpus sizes")
+    parser.add_option("--queries", type = "int", default = 200, help = "number of queries per run")
+    parser.add_option("--page-size", type = "int", default = 20)
+    parser.add_option("--compiler", default = "string", choices = ["string", "compiled", "both"],
+                      help = "query path: string, compiled or both")
+    parser.add_option("--in-process", action = "store_true", default = False, help = SUPPRESS_HELP)
+    parser.add_option("--index-dir", help = SUPPRESS_HELP)
+    options, args = parser.parse_args(argv)
+
+    engines = [engine.strip() for engine in options.engines.split(",") if engine.strip()]
+    sizes = [int(size) for size in options.sizes.split(",")]
+    modes = {"string": ["string"], "compiled": ["compiled"], "both": ["string", "compiled"]}[options.compiler]
+
+    index_dir = options.index_dir or tempfile.mkdtemp(prefix = "search-benchmark-")
+    try:
+        if options.in_process:
+            return run_in_process(engines, sizes, modes, options, index_dir)
+        skipped = set()
+        for engine, size, mode in [(e, s, m) for e in engines for s in sizes for m in modes]:
+            if engine not in skipped and run_isolated(engine, size, mode, options, index_dir) == SKIPPED:
+                skipped.add(engine)
+    finally:
+        if options.index_dir is None:
+            shutil.rmtree(index_dir, ignore_errors = True)
+    return 0
+
+
+def run_in_process(engines, sizes, modes, options, index_dir):
+    configure(engines, index_dir)
+    queries = query_mix(options.queries)
+    for engine in engines:
+        for size in sizes:
+            try:
+                for mode in modes:
+                    run(engine, size, queries, options.page_size,
+                        mock_es = (engine == "elasticsearch"), compile_queries = (mode == "compiled"))
+            except ImportError as e:
+                print("%s: skipped (%s)" % (engine, e))
+                return SKIPPED
+    return 0
+
+
+"""
+Uruchamia jeden pomiar w nowym procesie interpretera (zapytania i korpus
+sa deterministyczne, wiec kazdy proces mierzy to samo). Zwraca kod wyjscia.
+"""
+def run_isolated(engine, size, mode, options, index_dir):
+    argv = [
+        sys.executable, "-m", "search.benchmark", "--in-process",
+        "--engines", engine, "--sizes", str(size), "--compiler", mode,
+        "--queries", str(options.queries), "--page-size", str(options.page_size),
+        "--index-dir", index_dir,
+    ]
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([os.getcwd()] + [path for path in sys.path if path]))
+    sys.stdout.flush()
+    return subprocess.call(argv, env = env)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
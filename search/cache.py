@@ -0,0 +1,144 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+_missing = object()
+
+
+class LRUCache(object):
+    """
+    Ograniczony rozmiarem cache wypierajacy najdawniej uzywane wpisy.
+    Zlicza trafienia i chybienia.
+    """
+    def __init__(self, maxsize = 1000):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default = None):
+        with self.lock:
+            value = self.data.pop(key, _missing)
+            if value is _missing:
+                self.misses += 1
+                return default
+            self.data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last = False)
+
+    def get_or_create(self, key, factory):
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        return {
+            "size"   : len(self.data),
+            "maxsize": self.maxsize,
+            "hits"   : self.hits,
+            "misses" : self.misses,
+        }
+
+    def __len__(self):
+        return len(self.data)
+
+
+class LocalStore(object):
+    """
+    Magazyn cache wynikow w pamieci procesu
+    """
+    def __init__(self, size = 1000, **kwargs):
+        self.cache = LRUCache(size)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+
+
+class DjangoCacheStore(object):
+    """
+    Magazyn cache wynikow oparty o backend cache Django (np. wspolny
+    memcached dla wszystkich procesow)
+    """
+    def __init__(self, alias = "default", timeout = None, **kwargs):
+        try:
+            from django.core.cache import caches
+            self.cache = caches[alias]
+        except ImportError:
+            from django.core.cache import get_cache
+            self.cache = get_cache(alias)
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        if self.timeout is None:
+            self.cache.set(key, value)
+        else:
+            self.cache.set(key, value, self.timeout)
+
+
+stores = {
+    "local" : LocalStore,
+    "django": DjangoCacheStore,
+}
+
+
+class ResultCache(object):
+    """
+    Cache wynikow Database.find. Klucze zawieraja generacje z magazynu,
+    zmieniana przy kazdym commit() - wpisy z poprzednich generacji
+    przestaja byc osiagalne i wypadaja z magazynu w naturalny sposob.
+    Generacja startuje od aktualnego czasu, wiec utrata jej wpisu
+    w magazynie nie powoduje powrotu do starych kluczy.
+
+    Commit w innym procesie zmienia te generacje tylko we wspolnym
+    magazynie (django) - dlatego klucze Database.find zawieraja tez wersje
+    indeksu z backendu (DatabaseBackend.generation).
+    """
+    def __init__(self, store, namespace):
+        self.store = store
+        self.namespace = namespace
+        self.generation_key = self.make_key("generation")
+
+    def make_key(self, *parts):
+        return "search:" + hashlib.md5(repr((self.namespace,) + parts).encode("utf-8")).hexdigest()
+
+    def generation(self):
+        generation = self.store.get(self.generation_key)
+        if generation is None:
+            generation = int(time.time() * 1000)
+            self.store.set(self.generation_key, generation)
+        return generation
+
+    def invalidate(self):
+        self.store.set(self.generation_key, max(self.generation() + 1, int(time.time() * 1000)))
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value):
+        self.store.set(key, value)
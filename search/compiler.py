@@ -0,0 +1,185 @@
+"""
+Kompilator zapytan Query / OR bezposrednio do obiektow zapytan backendu,
+z pominieciem Query.toString i parsera tekstu.
+
+Drzewo zapytania jest najpierw sprowadzane (fold) do niezmiennego,
+hashowalnego AST - z ktorego mozna korzystac jako klucza cache zapytan:
+
+    ALL, NONE                               stale
+    ("and", (wezel, ...)), ("or", (...))    splaszczone, bez powtorzen
+    ("condition", pole, operator, wartosc)
+    ("range", Range)                        zakresy na jednym polu polaczone
+    ("raw", tekst)                          RawQuery - parsowane przez backend
+
+Podczas sprowadzania zwijane sa stale (AND z NONE daje NONE, OR z ALL
+daje ALL), zagniezdzone AND / OR tego samego rodzaju sa splaszczane,
+a zakresy na tym samym polu w AND sa przecinane (pusty przedzial to NONE).
+Puste zapytanie (Query()) to ALL - pasuje do wszystkich dokumentow, tak
+jak w backendzie memory.
+
+Kompilator jest uzywany, gdy settings.SEARCH[engine]["compile_queries"]
+jest ustawione.
+Backendy dostarczaja podklase z metodami emit_*.
+
+Wlaczenie compile_queries zmienia wyniki czesci zapytan wzgledem sciezki
+tekstowej (Query.toString i parser backendu):
+
+    Query()                 wszystkie dokumenty - tekstowo pusty tekst,
+                            czyli zadnych trafien (whoosh, xapian)
+    Query(title = u"a b")   oba slowa w polu title - tekstowo "title:a b",
+                            wiec "b" jest szukane we wszystkich polach
+"""
+from search.query import Conjunction, Range, RawQuery, intersect, is_empty
+from search.database import RANGE_BOUNDS
+from search.exceptions import NeedToReimplementThisMethodException
+
+ALL  = ("all", )
+NONE = ("none", )
+AND  = "and"
+OR   = "or"
+
+
+class QueryCompiler(object):
+    def __init__(self, engine):
+        self.engine = engine
+
+    def fold(self, query):
+        if isinstance(query, RawQuery):
+            return ("raw", query.query)
+        operator = OR if query.conjunction == Conjunction.OR else AND
+        children = [self.fold_condition(condition) for condition in query.conditions]
+        children.extend(self.fold(subquery) for subquery in query.subqueries)
+        if not children:
+            return ALL
+        return self.combine(operator, children)
+
+    def fold_condition(self, condition):
+        field, value = condition.field, condition.value
+        bound = RANGE_BOUNDS.get(condition.operator)
+        field_type = self.engine.range_fields.get(field)
+        if bound is not None and field_type is not None:
+            bound, inclusive = bound
+            value = field_type.convert(value)
+            if bound == "start":
+                return ("range", Range(field, value, inclusive, None, True))
+            return ("range", Range(field, None, True, value, inclusive))
+        if field_type is not None:
+            value = field_type.convert(value)
+        return ("condition", field, condition.operator, value)
+
+    def combine(self, operator, children):
+        flat = []
+        for child in children:
+            if child[0] == operator:
+                flat.extend(child[1])
+            else:
+                flat.append(child)
+
+        if operator == AND:
+            if NONE in flat:
+                return NONE
+            flat = self.merge_ranges([child for child in flat if child != ALL])
+            if flat is None:
+                return NONE
+            if not flat:
+                return ALL
+        else:
+            if ALL in flat:
+                return ALL
+            flat = [child for child in flat if child != NONE]
+            if not flat:
+                return NONE
+
+        unique = []
+        for child in flat:
+            if child not in unique:
+                unique.append(child)
+        if len(unique) == 1:
+            return unique[0]
+        return (operator, tuple(unique))
+
+    """
+    Laczy zakresy na tym samym polu (dzieci jednego AND). Zwraca None,
+    jesli ktorys z przedzialow jest pusty.
+    """
+    def merge_ranges(self, children):
+        merged = []
+        ranges = {}
+        for child in children:
+            if child[0] != "range":
+                merged.append(child)
+                continue
+            field = child[1].field
+            if field in ranges:
+                ranges[field] = intersect(ranges[field], child[1])
+            else:
+                ranges[field] = child[1]
+                merged.append(field)
+        out = []
+        for child in merged:
+            if type(child) == tuple:
+                out.append(child)
+            elif is_empty(ranges[child]):
+                return None
+            else:
+                out.append(("range", ranges[child]))
+        return out
+
+    """
+    Zwraca pare (zapytanie, filtr) dla AST. Zakresy polaczone z reszta
+    zapytania przez AND staja sie filtrem (None, jesli ich nie ma).
+    """
+    def compile(self, node):
+        ranges = []
+        if node[0] == "range":
+            ranges, node = [node[1]], ALL
+        elif node[0] == AND:
+            ranges = [child[1] for child in node[1] if child[0] == "range"]
+            if ranges:
+                children = [child for child in node[1] if child[0] != "range"]
+                node = ALL
+                if len(children) == 1:
+                    node = children[0]
+                elif children:
+                    node = (AND, tuple(children))
+        return self.emit(node), (self.emit_filter(ranges) if ranges else None)
+
+    def emit(self, node):
+        kind = node[0]
+        if kind == "all":
+            return self.emit_all()
+        if kind == "none":
+            return self.emit_none()
+        if kind == AND:
+            return self.emit_and([self.emit(child) for child in node[1]])
+        if kind == OR:
+            return self.emit_or([self.emit(child) for child in node[1]])
+        if kind == "range":
+            return self.emit_range(node[1])
+        if kind == "raw":
+            return self.emit_raw(node[1])
+        return self.emit_condition(node[1], node[2], node[3])
+
+    def emit_all(self):
+        raise NeedToReimplementThisMethodException("emit_all()")
+
+    def emit_none(self):
+        raise NeedToReimplementThisMethodException("emit_none()")
+
+    def emit_and(self, queries):
+        raise NeedToReimplementThisMethodException("emit_and(queries)")
+
+    def emit_or(self, queries):
+        raise NeedToReimplementThisMethodException("emit_or(queries)")
+
+    def emit_range(self, _range):
+        raise NeedToReimplementThisMethodException("emit_range(_range)")
+
+    def emit_filter(self, ranges):
+        raise NeedToReimplementThisMethodException("emit_filter(ranges)")
+
+    def emit_raw(self, text):
+        raise NeedToReimplementThisMethodException("emit_raw(text)")
+
+    def emit_condition(self, field, operator, value):
+        raise NeedToReimplementThisMethodException("emit_condition(field, operator, value)")
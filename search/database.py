@@ -1,11 +1,31 @@
 from django.db import settings
-from search.query import Condition
-from exceptions import InvalidFieldException
+from search.query import Condition, Conjunction, Range, intersect
+from search.document import Hit, serialize_value
+from search.pool import pool
+from search.cache import ResultCache, stores
+from search.scheduler import CommitScheduler, written
+from search.fingerprints import FingerprintStore, fingerprint
+from search import instrumentation
+from exceptions import InvalidFieldException, InvalidDatabasePrefixException, \
+    UUIDFieldNotPresentException, NeedToReimplementThisMethodException
+from collections import deque
+import json
+import logging
+import time
+
+logger = logging.getLogger("search.database")
+
+_backends = {}
 
 class Database(object):
     prefix = None
     engine = None
     schema = {}
+    fields = frozenset()
+    result_cache = None
+    scheduler = None
+    submissions = None
+    fingerprint_store = None
 
     def __init__(self, dbname, engine = "default"):
         if not self.prefix:
@@ -13,10 +33,7 @@ class Database(object):
 
         search = settings.SEARCH[engine]
 
-        backend = search["backend"].split(".")
-
-        imp = __import__(".".join(backend[:-1]), globals(), locals(), [backend[-1]])
-        backend = getattr(imp,backend[-1])
+        backend = self.load_backend(search["backend"])
 
         params = {
             "name"   : self.prefix + "/" + dbname,
@@ -25,42 +42,388 @@ class Database(object):
 
         params.update(search.get("params", {}))
 
-        self.engine = backend(**params)
-        self.engine.database = self
+        self.engine = self.create_engine(backend, params, search)
+        self.fields = frozenset(self.schema.keys())
+        self.key = (engine, params["name"])
+
+        if search.get("result_cache"):
+            self.result_cache = ResultCache(
+                self.load_result_store(engine, search["result_cache"]),
+                (engine, params["name"])
+            )
+
+        if search.get("fingerprints"):
+            self.fingerprint_store = self.load_fingerprints()
+
+        if search.get("commit_scheduler"):
+            self.scheduler = pool.get(
+                ("scheduler", engine, params["name"]),
+                lambda: self.create_scheduler(self.create_engine(backend, params, search), search["commit_scheduler"]),
+                ttl = None
+            )
+            self.submissions = deque()
+
+    def create_engine(self, backend, params, search):
+        return self.configure_engine(backend(**params), search)
+
+    def configure_engine(self, engine, search):
+        engine.database = self
+        engine.pool_ttl = search.get("pool_ttl", DatabaseBackend.pool_ttl)
+        engine.query_cache_size = search.get("query_cache_size", DatabaseBackend.query_cache_size)
+        engine.slow_query_threshold = search.get("slow_query_threshold")
+        engine.compile_queries = search.get("compile_queries", DatabaseBackend.compile_queries)
+        return engine
+
+    def create_scheduler(self, engine, config):
+        engine.database = self
+        return CommitScheduler(engine, on_commit = self.committed, **config)
+
+    """
+    Wywolywane po kazdym zatwierdzeniu zapisow (rowniez przez watek
+    commit_scheduler)
+    """
+    def committed(self):
+        if self.result_cache is not None:
+            self.result_cache.invalidate()
+        if self.fingerprint_store is not None:
+            self.fingerprint_store.save()
+
+    """
+    Odciski dokumentow sa zapisywane obok indeksu (fingerprint_path backendu)
+    i wspoldzielone przez wszystkie instancje bazy w procesie.
+    """
+    def load_fingerprints(self):
+        return pool.get(
+            ("fingerprints", ) + self.key,
+            lambda: FingerprintStore(self.engine.fingerprint_path()),
+            ttl = None
+        )
+
+    """
+    Klasy backendow sa importowane raz na proces
+    """
+    @staticmethod
+    def load_backend(path):
+        backend = _backends.get(path)
+        if backend is None:
+            module, name = path.rsplit(".", 1)
+            imp = __import__(module, globals(), locals(), [name])
+            backend = _backends[path] = getattr(imp, name)
+        return backend
+
+    """
+    Magazyn cache wynikow jest wspolny dla wszystkich baz danego silnika.
+    "store" to "local", "django" lub sciezka do wlasnej klasy, pozostale
+    klucze konfiguracji trafiaja do jej konstruktora.
+    """
+    @classmethod
+    def load_result_store(cls, engine, config):
+        def create():
+            options = dict(config)
+            store = options.pop("store", "local")
+            if store in stores:
+                store = stores[store]
+            else:
+                store = cls.load_backend(store)
+            return store(**options)
+
+        return pool.get(("results", engine), create, ttl = None)
+
+    """
+    documents.indexed jest zliczane dopiero po udanym zapisie - w trybie
+    commit_scheduler przez jego watek.
+
+    W trybie commit_scheduler zapisy trafiaja do kolejki watku w tle, a
+    zwracany jest ich Submission. Zatwierdzone bez bledu sa zapominane,
+    pozostale czekaja na flush() lub rollback() tej instancji.
+    """
+    def _write(self, method, *args):
+        if self.scheduler is None:
+            result = getattr(self.engine, method)(*args)
+            instrumentation.incr("documents.indexed", written(method, args))
+            return result
+        submission = self.scheduler.submit(method, *args)
+        submissions = self.submissions
+        while submissions and submissions[0].done() and submissions[0].error is None:
+            submissions.popleft()
+        submissions.append(submission)
+        return submission
+
+    """
+    Odciski (digests: uuid -> odcisk, None dla usunietych) trafiaja do
+    magazynu dopiero po udanym zapisie - w trybie commit_scheduler po
+    commicie, ktory go obejmuje. Nieudany lub anulowany zapis nie zmienia
+    magazynu, wiec commit nie utrwali odciskow dokumentow spoza indeksu.
+    """
+    def _write_recorded(self, store, digests, method, *args):
+        result = self._write(method, *args)
+        if store is None or not digests:
+            return result
+        if self.scheduler is None:
+            self._record(store, digests)
+        else:
+            def done(submission):
+                if submission.error is None and not submission.cancelled:
+                    self._record(store, digests)
+            result.add_done_callback(done)
+        return result
+
+    def _record(self, store, digests):
+        for uuid, digest in digests.items():
+            if digest is None:
+                store.delete(uuid)
+            else:
+                store.set(uuid, digest)
+
+    def _digests(self, documents):
+        if self.fingerprint_store is None:
+            return None
+        return dict((document.get_uuid(), fingerprint(document)) for document in documents)
 
     def add(self, document):
         self.validate_document(document)
-        return self.engine.add(document)
+        return self._write_recorded(self.fingerprint_store, self._digests([document]), "add", document)
 
     def replace_document(self, uuid, document):
         self.validate_document(document)
-        return self.engine.replace(uuid, document)
+        return self._write_recorded(self.fingerprint_store, self._digests([document]), "replace", uuid, document)
+
+    def add_many(self, documents, batch_size = 1000):
+        return self._bulk("add_many", documents, batch_size)
+
+    def replace_many(self, documents, batch_size = 1000):
+        return self._bulk("replace_many", documents, batch_size)
+
+    """
+    Przy wlaczonych odciskach (fingerprints) replace_many pomija dokumenty,
+    ktore nie zmienily sie od ostatniego zapisu.
+    """
+    def _bulk(self, method, documents, batch_size):
+        result = BulkResult()
+        started = time.time()
+        store = self.fingerprint_store
+        batch, digests = [], {}
+        for document in documents:
+            self.validate_document(document)
+            if store is not None:
+                uuid, digest = document.get_uuid(), fingerprint(document)
+                if method == "replace_many" and store.get(uuid) == digest:
+                    result.skipped += 1
+                    continue
+                digests[uuid] = digest
+            batch.append(document)
+            if len(batch) >= batch_size:
+                self._write_recorded(store, digests, method, batch)
+                result.count += len(batch)
+                batch, digests = [], {}
+        if batch:
+            self._write_recorded(store, digests, method, batch)
+            result.count += len(batch)
+        result.elapsed = time.time() - started
+        return result
+
+    def rebuild(self, documents, procs = None, merge = True):
+        result = BulkResult()
+        started = time.time()
+        digests = {}
+
+        def validated():
+            for document in documents:
+                self.validate_document(document)
+                if self.fingerprint_store is not None:
+                    digests[document.get_uuid()] = fingerprint(document)
+                result.count += 1
+                yield document
+
+        if self.scheduler is not None:
+            self.scheduler.call("rebuild", validated(), procs, merge).result()
+        else:
+            self.engine.rebuild(validated(), procs = procs, merge = merge)
+        if self.fingerprint_store is not None:
+            self.fingerprint_store.reset(digests)
+            self.fingerprint_store.save()
+        result.elapsed = time.time() - started
+        instrumentation.incr("documents.indexed", result.count)
+        return result
 
     def remove_document(self, uuid):
-        return self.engine.remove(uuid)
+        return self._write_recorded(self.fingerprint_store, {uuid: None}, "remove", uuid)
 
+    """
+    Synchronizuje indeks ze zrodlem: zapisuje tylko nowe i zmienione
+    dokumenty (wg odciskow tresci), a dokumenty znane z odciskow, ktorych
+    nie bylo w documents, usuwa. Na koncu zatwierdza zmiany (flush).
+    Usuwane sa tylko dokumenty, ktore maja odcisk - indeks zbudowany bez
+    odciskow warto raz przebudowac (rebuild) przy wlaczonych fingerprints.
+    """
+    def sync(self, documents, batch_size = 1000):
+        store = self.fingerprint_store or self.load_fingerprints()
+        result = SyncResult()
+        started = time.time()
+        seen = set()
+        batch, digests = [], {}
+        for document in documents:
+            self.validate_document(document)
+            uuid, digest = document.get_uuid(), fingerprint(document)
+            seen.add(uuid)
+            previous = store.get(uuid)
+            if previous == digest:
+                result.skipped += 1
+                continue
+            if previous is None:
+                result.added += 1
+            else:
+                result.updated += 1
+            digests[uuid] = digest
+            batch.append(document)
+            if len(batch) >= batch_size:
+                self._write_recorded(store, digests, "replace_many", batch)
+                batch, digests = [], {}
+        if batch:
+            self._write_recorded(store, digests, "replace_many", batch)
+
+        for uuid in store.uuids() - seen:
+            self._write_recorded(store, {uuid: None}, "remove", uuid)
+            result.removed += 1
+
+        self.flush()
+        store.save()
+        result.elapsed = time.time() - started
+        return result
+
+    """
+    W trybie commit_scheduler najpierw zatwierdzane sa zapisy tej instancji
+    (flush). Sam scheduler jest wspoldzielony - zatrzymuje go dopiero
+    wyjscie z procesu albo usuniecie z puli.
+    """
     def close(self):
+        if self.scheduler is not None:
+            self.flush()
         return self.engine.close()
 
     def begin(self):
         pass
 
+    """
+    W trybie commit_scheduler anulowane sa tylko zapisy tej instancji,
+    ktore jeszcze czekaja w kolejce. Zapisy juz wykonane przez watek w tle
+    zostana zatwierdzone - zwracana jest ich liczba.
+    """
     def rollback(self):
-        return self.engine.rollback()
+        if self.fingerprint_store is not None:
+            self.fingerprint_store.load()
+        if self.scheduler is None:
+            return self.engine.rollback()
+        submissions, self.submissions = self.submissions, deque()
+        applied = 0
+        for submission in submissions:
+            if not submission.cancel() and not submission.done():
+                applied += 1
+        if applied:
+            logger.warning("rollback: %d writes already applied by the commit scheduler", applied)
+        return applied
 
+    """
+    W trybie commit_scheduler commit() to flush() - wymusza commit watku w
+    tle, czeka na niego i rzuca bledy zapisow tej instancji. Po nieudanym
+    commicie odciski sa wczytywane ponownie z dysku.
+    """
     def commit(self):
-        return self.engine.commit()
+        if self.scheduler is not None:
+            return self.flush()
+        with instrumentation.timer("commit"):
+            try:
+                result = self.engine.commit()
+            except Exception:
+                if self.fingerprint_store is not None:
+                    self.fingerprint_store.load()
+                raise
+        self.committed()
+        return result
+
+    def optimize(self):
+        if self.scheduler is not None:
+            return self.scheduler.call("optimize").result()
+        return self.engine.optimize()
+
+    """
+    W trybie commit_scheduler (wait = True) rzuca pierwszy blad zapisow
+    tej instancji od poprzedniego flush().
+    """
+    def flush(self, wait = True):
+        if self.scheduler is None:
+            return self.commit()
+        if not wait:
+            return self.scheduler.flush(False)
+        submissions, self.submissions = self.submissions, deque()
+        self.scheduler.flush()
+        for submission in submissions:
+            if submission.error is not None:
+                raise submission.error
+
+    def scheduler_stats(self):
+        if self.scheduler is None:
+            return {}
+        return self.scheduler.stats()
 
     def find(self, query, order = None):
-        return self.engine.find(query, order)
+        with instrumentation.timer("find"):
+            result = self.engine.find(query, order)
+        if self.result_cache is not None:
+            result = CachedSearchResult(
+                result,
+                self.result_cache,
+                (self.result_cache.generation(), self.engine.generation(), str(query), tuple(sorted((order or {}).items())))
+            )
+        result.source = (query, order)
+        return result
+
+    def query_cache_stats(self):
+        cache = self.engine.query_cache()
+        if cache is None:
+            return {}
+        return cache.stats()
+
+    def count(self, query):
+        return self.engine.count(query)
+
+    """
+    Zwraca {pole: {wartosc: liczba trafien}} dla limit najczestszych wartosci
+    kazdego z pol (IntegerField albo CharField z split_to_terms = False).
+    limit = None - wszystkie wartosci.
+    """
+    def facets(self, query, fields, limit = 100):
+        for field in fields:
+            if field not in self.fields:
+                raise InvalidFieldException("%s not in %s" % (field, ",".join(self.schema.keys())))
+        return self.engine.facets(query, fields, limit)
 
     def get(self, query):
         result = self.engine.find(query, None)
+        result.source = (query, None)
         page = result.page(1, 20)
         if len(page) > 0:
             return page[0].data
         return None
 
+    def get_by_uuid(self, uuid):
+        return self.get_many([uuid])[0]
+
+    """
+    Pobiera dokumenty po uuid jednym wywolaniem backendu. Zwraca liste
+    w kolejnosci uuids, z None w miejscu dokumentow, ktorych nie ma.
+    """
+    def get_many(self, uuids):
+        uuids = list(uuids)
+        found = self.engine.get_many(uuids)
+        out = []
+        for uuid in uuids:
+            data = found.get(uuid)
+            if data is not None:
+                data = self.document(data = data, restore = True).data
+            out.append(data)
+        return out
+
     def validate_document(self, document):
         if not document.is_uuid_present(self.schema):
             raise UUIDFieldNotPresentException()
@@ -68,12 +431,82 @@ class Database(object):
         for field, value in document.data.items():
             #__isort to magiczne pole, ktore jest generowane dynamicznie,
             #bez wiedzy uzytkownika.
-            if not self.schema.has_key(field) and "__isort" not in field:
+            if field not in self.fields and "__isort" not in field:
                 raise InvalidFieldException("%s not in %s" % (field, ",".join(self.schema.keys())))
 
 
+class BulkResult(object):
+    """
+    Podsumowanie operacji add_many / replace_many
+    """
+    count   = 0
+    skipped = 0
+    elapsed = 0.0
+
+    @property
+    def rate(self):
+        if not self.elapsed:
+            return float(self.count)
+        return self.count / self.elapsed
+
+    def __str__(self):
+        out = "%d documents in %.2fs (%.1f docs/sec)" % (self.count, self.elapsed, self.rate)
+        if self.skipped:
+            out += ", %d unchanged skipped" % self.skipped
+        return out
+
+
+"""
+Operator warunku -> (granica zakresu, czy domknieta)
+"""
+RANGE_BOUNDS = {
+    Condition.OPERATOR_LESS_THAN    : ("end", False),
+    Condition.OPERATOR_LESS_EQUAL   : ("end", True),
+    Condition.OPERATOR_GREATER_THAN : ("start", False),
+    Condition.OPERATOR_GREATER_EQUAL: ("start", True),
+}
+
+
+class ConditionFilter(object):
+    """
+    Przekazywany do Query.toString zamiast backendu - pomija warunki
+    wyciagniete do filtrow, pozostale renderuje backend.
+    """
+    def __init__(self, engine, skip):
+        self.engine = engine
+        self.skip   = skip
+
+    def parseQueryCondition(self, condition):
+        if id(condition) in self.skip:
+            return None
+        return self.engine.parseQueryCondition(condition)
+
+
+class SyncResult(object):
+    """
+    Podsumowanie operacji sync
+    """
+    added   = 0
+    updated = 0
+    skipped = 0
+    removed = 0
+    elapsed = 0.0
+
+    def __str__(self):
+        return "%d added, %d updated, %d skipped, %d removed in %.2fs" % (
+            self.added, self.updated, self.skipped, self.removed, self.elapsed
+        )
+
+
 class DatabaseBackend(object):
     database = None
+    pool_ttl = 300
+    query_cache_size = 1000
+    slow_query_threshold = None
+    #kompilowanie zapytan do obiektow backendu zamiast Query.toString (search.compiler)
+    compile_queries = False
+    #pole -> typ pola (Fields.*), dla pol z range_filter
+    range_fields = {}
     def __init__(self, name):
         raise NeedToReimplementThisMethodException("__init__")
 
@@ -86,6 +519,121 @@ class DatabaseBackend(object):
     def replace(self, document):
         raise NeedToReimplementThisMethodException("replace(document)")
 
+    """
+    Domyslne implementacje operacji wsadowych - backendy, ktore maja
+    natywna sciezke bulk, nadpisuja je.
+    """
+    def add_many(self, documents):
+        for document in documents:
+            self.add(document)
+
+    def replace_many(self, documents):
+        for document in documents:
+            self.replace(document.get_uuid(), document)
+
+    def rebuild(self, documents, procs = None, merge = True):
+        raise NeedToReimplementThisMethodException("rebuild(documents)")
+
+    def get_many(self, uuids):
+        raise NeedToReimplementThisMethodException("get_many(uuids)")
+
+    def optimize(self):
+        raise NeedToReimplementThisMethodException("optimize()")
+
+    """
+    Sciezka pliku odciskow dokumentow (obok indeksu). None - odciski sa
+    trzymane tylko w pamieci procesu.
+    """
+    def fingerprint_path(self):
+        return None
+
+    """
+    Otwiera zasoby potrzebne do wyszukiwania (indeks, searcher, polaczenie)
+    w puli procesu - wolane przez search.warmup przed pierwszym zapytaniem.
+    """
+    def warmup(self):
+        pass
+
+    """
+    Pliki indeksu na dysku - search.warmup moze je wczytac do cache stron
+    systemu operacyjnego.
+    """
+    def index_files(self):
+        return []
+
+    """
+    Wersja indeksu widziana przez czytelnikow tego procesu (np. generacja
+    TOC whoosha) - czesc klucza cache wynikow, dzieki czemu commit innego
+    procesu uniewaznia strony rowniez w magazynie lokalnym. None - backend
+    jej nie zna, strony uniewaznia tylko committed() (wspolny magazyn).
+    """
+    def generation(self):
+        return None
+
+    def count(self, query):
+        result = self.find(query, None)
+        result.page(1, 1)
+        return result.rows
+
+    def facets(self, query, fields, limit = 100):
+        raise NeedToReimplementThisMethodException("facets(query, fields, limit)")
+
+    """
+    Zwraca zdekodowana wartosc jednego pola z surowych danych przechowywanych
+    trafienia (tych samych, ktore przyjmuje stored_data).
+    """
+    def stored_value(self, stored, field):
+        return stored.get(field)
+
+    def top_counts(self, counts, limit):
+        top = sorted(counts.items(), key = lambda item: item[1], reverse = True)
+        return dict(top[:limit])
+
+    """
+    Dzieli zapytanie na tekst i filtry zakresowe. Filtrami staja sie warunki
+    zakresowe na polach z range_filter, polaczone z reszta zapytania przez AND
+    (rowniez w zagniezdzonych podzapytaniach AND) - zakresy wewnatrz OR
+    zostaja w tekscie. Zwraca pare (tekst, krotka Range).
+    """
+    def split_ranges(self, query):
+        ranges = {}
+        skip = set()
+        self._collect_ranges(query, ranges, skip)
+        if not skip:
+            return query.toString(self), ()
+        return query.toString(ConditionFilter(self, skip)), tuple(
+            _range for field, _range in sorted(ranges.items())
+        )
+
+    def _collect_ranges(self, query, ranges, skip):
+        if query.conjunction != Conjunction.AND:
+            return
+        for condition in query.conditions:
+            bound = RANGE_BOUNDS.get(condition.operator)
+            field_type = self.range_fields.get(condition.field)
+            if bound is None or field_type is None:
+                continue
+            bound, inclusive = bound
+            value = field_type.convert(condition.value)
+            if bound == "start":
+                _range = Range(condition.field, value, inclusive, None, True)
+            else:
+                _range = Range(condition.field, None, True, value, inclusive)
+            #kolejne granice na tym samym polu zaweza (AND), a nie zastepuja
+            if condition.field in ranges:
+                _range = intersect(ranges[condition.field], _range)
+            ranges[condition.field] = _range
+            skip.add(id(condition))
+        for subquery in query.subqueries:
+            self._collect_ranges(subquery, ranges, skip)
+
+    """
+    Cache skompilowanych zapytan backendu, kluczowany wynikiem Query.toString.
+    Backendy, ktore nie kompiluja zapytan, zwracaja None.
+    """
+    def query_cache(self):
+        return None
+
     def parseQueryCondition(self, condition):
         if condition.operator == Condition.OPERATOR_CONTAINS:
             return u'%s:%s' % (condition.field, condition.value)
@@ -94,13 +642,194 @@ class DatabaseBackend(object):
 
 
 class SearchResult:
-    rows = 0
+    rows   = 0
+    engine = None
+    source = None
 
+    """
+    Pomiar czasu (i log wolnych zapytan, jesli ustawiono slow_query_threshold)
+    odbywa sie tylko wtedy, gdy jest wlaczony - w przeciwnym razie strona
+    jest budowana bez zadnego narzutu. Etapy parse, search i load mierza
+    backendy, document - budowanie dokumentow, page - calosc.
+    """
     def page(self, page, limit):
-        pass
+        if not instrumentation.enabled and self.engine.slow_query_threshold is None:
+            return [self._restore(data) for data in self._fetch((page - 1) * limit, limit)]
+
+        started = time.time()
+        hits = self._fetch((page - 1) * limit, limit)
+        with instrumentation.timer("document"):
+            documents = [self._restore(data) for data in hits]
+        instrumentation.incr("hits", len(documents))
+
+        elapsed = time.time() - started
+        instrumentation.timing("page", elapsed)
+        threshold = self.engine.slow_query_threshold
+        if threshold is not None and elapsed >= threshold and self.source is not None:
+            query, order = self.source
+            instrumentation.log_slow_query(self.engine, query, order, elapsed)
+        return documents
+
+    """
+    Stronicowanie kursorem. Zwraca pare (dokumenty, kursor), gdzie kursor
+    przekazuje sie do kolejnego wywolania; None oznacza poczatek (w argumencie)
+    lub koniec wynikow (w wartosci zwracanej).
+
+    Kursor jest wazny tylko dla tego obiektu wyniku - to nie jest token do
+    przekazania miedzy zadaniami. W whooshu to pozycja na liscie trafien
+    wyliczonej raz na jednym searcherze (zwalnianym w free()), w
+    elasticsearchu - identyfikator scrolla, a w pozostalych backendach
+    zwykle przesuniecie (kazda strona to nowe wyszukiwanie, jak page()).
+    """
+    def after(self, cursor, limit):
+        hits, cursor = self._after(cursor, limit)
+        return [self._restore(data) for data in hits], cursor
+
+    """
+    Zwraca strone trafien jako obiekty Hit - bez budowania dokumentow
+    """
+    def hits(self, page, limit):
+        return [Hit(stored, self.engine) for stored in self._stored((page - 1) * limit, limit)]
+
+    """
+    Generator kolejnych stron (kursorem). Po ostatniej stronie, albo gdy
+    generator zostanie porzucony i zamkniety, zwalnia searcher (free()).
+    """
+    def pages(self, limit):
+        cursor = None
+        try:
+            while True:
+                documents, cursor = self.after(cursor, limit)
+                if documents:
+                    yield documents
+                if cursor is None:
+                    break
+        finally:
+            self.free()
+
+    """
+    Generator zwracajacy kolejne trafienia bez budowania calej listy wynikow.
+    Dla raw == True zwracane sa slowniki pol przechowywanych zamiast dokumentow.
+    """
+    def iter_documents(self, chunk_size = 100, raw = False):
+        cursor = None
+        try:
+            while True:
+                hits, cursor = self._after(cursor, chunk_size)
+                for data in hits:
+                    if raw:
+                        yield data
+                    else:
+                        yield self._restore(data)
+                if cursor is None:
+                    break
+        finally:
+            self.free()
+
+    def __iter__(self):
+        return self.iter_documents()
+
+    """
+    Zwraca strone wynikow jako krotki wartosci kolumn, czytane wprost
+    z danych przechowywanych backendu - bez budowania dokumentow. Dla
+    as_dict == True zwracane sa slowniki jak z Document.serialize(columns).
+    """
+    def page_as_rows(self, page, limit, columns, as_dict = False):
+        value = self.engine.stored_value
+        rows = []
+        for stored in self._stored((page - 1) * limit, limit):
+            row = tuple(serialize_value(value(stored, column)) for column in columns)
+            if as_dict:
+                row = dict((column, cell) for column, cell in zip(columns, row) if cell is not None)
+            rows.append(row)
+        return rows
+
+    """
+    Zapisuje wszystkie trafienia do fp jako JSON lines (jeden obiekt
+    z kolumnami columns w linii), porcjami po chunk_size. Zwraca liczbe
+    zapisanych trafien.
+    """
+    def export_jsonl(self, fp, columns, chunk_size = 500):
+        count = 0
+        for data in self.iter_documents(chunk_size, raw = True):
+            row = {}
+            for column in columns:
+                value = data.get(column)
+                if value is not None:
+                    row[column] = serialize_value(value)
+            fp.write(json.dumps(row) + "\n")
+            count += 1
+        return count
+
+    """
+    Domyslnie kursor jest przesunieciem - backendy, ktore potrafia kontynuowac
+    wyszukiwanie taniej, nadpisuja te metode.
+    """
+    def _after(self, cursor, limit):
+        start = cursor or 0
+        hits = self._fetch(start, limit)
+        if len(hits) < limit:
+            return hits, None
+        return hits, start + len(hits)
+
+    """
+    Zwraca liste slownikow z polami przechowywanymi dla trafien [start, start + limit)
+    """
+    def _fetch(self, start, limit):
+        return [self.engine.stored_data(stored) for stored in self._stored(start, limit)]
+
+    """
+    Zwraca surowe dane przechowywane backendu dla trafien [start, start + limit)
+    i ustawia rows
+    """
+    def _stored(self, start, limit):
+        return []
+
+    def _restore(self, data):
+        return self.engine.database.document(data = data, restore = True)
 
     """
     Ta metoda zwalnia uchwyt do searchera
     """
     def free(self):
         pass
+
+
+class CachedSearchResult(SearchResult):
+    """
+    Wynik wyszukiwania obsluzony z cache wynikow - strony (start, limit) sa
+    zapamietywane razem z liczba trafien. Stronicowanie kursorem i iteracja
+    zawsze ida do backendu.
+    """
+    def __init__(self, result, cache, key):
+        self.result = result
+        self.engine = result.engine
+        self.cache  = cache
+        self.key    = key
+
+    def _stored(self, start, limit):
+        key = self.cache.make_key(*(self.key + (start, limit)))
+        cached = self.cache.get(key)
+        if cached is None:
+            hits = self.result._stored(start, limit)
+            cached = (self.result.rows, hits)
+            self.cache.set(key, cached)
+        self.rows, hits = cached
+        return hits
+
+    def _after(self, cursor, limit):
+        hits, cursor = self.result._after(cursor, limit)
+        self.rows = self.result.rows
+        return hits, cursor
+
+    def _restore(self, data):
+        return self.result._restore(data)
+
+    def free(self):
+        self.result.free()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.free()
@@ -1,4 +1,37 @@
 import datetime
+import unicodedata
+
+"""
+Wartosc pola w postaci gotowej do serializacji (np. json.dumps)
+"""
+def serialize_value(value):
+    if type(value) == str:
+        return unicode(value, "utf-8")
+    if type(value) == datetime.datetime:
+        return str(value)
+    return value
+
+"""
+Klucz sortowania dla pol z sort = True, wyliczany raz przy zapisie
+dokumentu (pole __isort). Porownanie podstawowe pomija spacje, wielkosc
+liter i znaki diakrytyczne (NFKD bez znakow laczacych - "a" i "a"
+z ogonkiem sa obok siebie); po separatorze doklejona jest pelna wartosc
+malymi literami, ktora rozstrzyga remisy, wiec kolejnosc jest
+deterministyczna.
+"""
+def collation_key(value):
+    if value is None:
+        return u""
+    if type(value) == str:
+        value = unicode(value, "utf-8")
+    elif type(value) != unicode:
+        value = unicode(value)
+    value = u"".join(value.split()).lower()
+    primary = u"".join(
+        char for char in unicodedata.normalize("NFKD", value)
+        if not unicodedata.combining(char)
+    )
+    return primary + u"\x00" + value
 
 class Document(object):
     raw_data = {}
@@ -52,18 +85,64 @@ class Document(object):
         return None
 
     def serialize(self, columns):
+        data = self.data
         out = {}
         for column in columns:
-            value = self.data.get(column)
+            value = data.get(column)
             if value is not None:
-                if type(value) == datetime.datetime:
-                    value = str(value)
-                out[column] = value
+                out[column] = serialize_value(value)
         return out
 
+class Hit(object):
+    """
+    Lekkie trafienie wyszukiwania, tylko do odczytu. Trzyma surowe dane
+    przechowywane backendu i dekoduje pola dopiero przy odczycie - strona
+    wynikow, z ktorej czyta sie dwa, trzy pola, nie kosztuje budowania
+    pelnych dokumentow. Pelny dokument (z restore()) zwraca document().
+    """
+    __slots__ = ("_stored", "_engine", "_values")
+
+    def __init__(self, stored, engine):
+        object.__setattr__(self, "_stored", stored)
+        object.__setattr__(self, "_engine", engine)
+        object.__setattr__(self, "_values", {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Hit is read-only")
+
+    def __getitem__(self, field):
+        try:
+            return self._values[field]
+        except KeyError:
+            pass
+        value = self._engine.stored_value(self._stored, field)
+        if type(value) == str:
+            value = unicode(value, "utf-8")
+        self._values[field] = value
+        return value
+
+    def get(self, field, default = None):
+        value = self[field]
+        if value is None:
+            return default
+        return value
+
+    def serialize(self, columns):
+        out = {}
+        for column in columns:
+            value = self[column]
+            if value is not None:
+                out[column] = serialize_value(value)
+        return out
+
+    def document(self):
+        return self._engine.database.document(data = self._engine.stored_data(self._stored), restore = True)
+
 class Fields(object):
     class Field(object):
         store = False
+        #pola, po ktorych zakresy (__lt, __ge, ...) sa filtrami backendu
+        range_filter = False
 
         def __init__(self, store = False, analyze = False, sort = False, split_to_terms = True):
             self.store = store
@@ -71,6 +150,9 @@ class Fields(object):
             self.sort = sort
             self.split_to_terms = split_to_terms
 
+        def convert(self, value):
+            return value
+
     class CharField(Field):
         pass
 
@@ -78,4 +160,29 @@ class Fields(object):
         pass
 
     class IntegerField(Field):
-        pass
+        range_filter = True
+
+        def convert(self, value):
+            return int(value)
+
+    class FloatField(Field):
+        range_filter = True
+
+        def convert(self, value):
+            return float(value)
+
+    class DateTimeField(Field):
+        range_filter = True
+        formats = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d")
+
+        def convert(self, value):
+            if type(value) == datetime.datetime:
+                return value
+            if type(value) == datetime.date:
+                return datetime.datetime(value.year, value.month, value.day)
+            for format in self.formats:
+                try:
+                    return datetime.datetime.strptime(value, format)
+                except ValueError:
+                    pass
+            raise ValueError("%r is not a valid datetime" % (value, ))
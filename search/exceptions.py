@@ -11,4 +11,10 @@ class NeedToReimplementThisMethodException(Exception):
     pass
 
 class DatabaseLockedException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class ReadOnlyDatabaseException(Exception):
+    pass
+
+class InvalidMergePolicyException(Exception):
+    pass
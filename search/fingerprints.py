@@ -0,0 +1,76 @@
+"""
+Odciski (skroty) tresci dokumentow - pozwalaja pominac zapis dokumentow,
+ktore nie zmienily sie od ostatniej synchronizacji.
+"""
+import codecs
+import hashlib
+import os
+import threading
+
+
+def fingerprint(document):
+    items = sorted(
+        (field, value) for field, value in document.data.items()
+        #__isort jest generowane przez backend podczas zapisu
+        if "__isort" not in field
+    )
+    return hashlib.md5(repr(items).encode("utf-8")).hexdigest()[:16]
+
+
+class FingerprintStore(object):
+    """
+    Mapa uuid -> odcisk. Jest trzymana w pamieci i zapisywana (atomowo,
+    przez plik tymczasowy) do pliku obok indeksu w save(). Bez sciezki
+    (backendy bez indeksu na dysku) istnieje tylko w pamieci procesu.
+    """
+    def __init__(self, path = None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        with self.lock:
+            self.digests = {}
+            self.dirty = False
+            if self.path is None or not os.path.exists(self.path):
+                return
+            with codecs.open(self.path, "r", "utf-8") as fp:
+                for line in fp:
+                    uuid, digest = line.rstrip("\n").split("\t")
+                    self.digests[uuid] = digest
+
+    def save(self):
+        with self.lock:
+            if self.path is None or not self.dirty:
+                return
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            temp = self.path + ".tmp"
+            with codecs.open(temp, "w", "utf-8") as fp:
+                for uuid, digest in self.digests.items():
+                    fp.write(u"%s\t%s\n" % (uuid, digest))
+            os.rename(temp, self.path)
+            self.dirty = False
+
+    def get(self, uuid):
+        return self.digests.get(uuid)
+
+    def set(self, uuid, digest):
+        with self.lock:
+            self.digests[uuid] = digest
+            self.dirty = True
+
+    def delete(self, uuid):
+        with self.lock:
+            if self.digests.pop(uuid, None) is not None:
+                self.dirty = True
+
+    def reset(self, digests):
+        with self.lock:
+            self.digests = dict(digests)
+            self.dirty = True
+
+    def uuids(self):
+        with self.lock:
+            return set(self.digests)
@@ -0,0 +1,135 @@
+"""
+Instrumentacja: czasy operacji, liczniki i log wolnych zapytan.
+
+Kolektory rejestruje sie przez register(). Dopoki zaden nie jest
+zarejestrowany, enabled == False, a timer() zwraca wspoldzielony pusty
+kontekst - wywolujacy nie mierza niczego.
+
+Kolektor to dowolny obiekt z metodami timing(name, seconds) i incr(name, value).
+
+Czasy etapow strony wynikow sie nie pokrywaja: parse (budowanie zapytania
+backendu), search (wykonanie), load (odczyt pol przechowywanych), document
+(budowanie dokumentow). page to czas calej strony.
+"""
+import logging
+import socket
+import threading
+import time
+
+slow_query_log = logging.getLogger("search.slowquery")
+
+collectors = []
+enabled = False
+
+
+def register(collector):
+    global enabled
+    collectors.append(collector)
+    enabled = True
+
+
+def unregister(collector):
+    global enabled
+    collectors.remove(collector)
+    enabled = bool(collectors)
+
+
+def timing(name, seconds):
+    for collector in collectors:
+        collector.timing(name, seconds)
+
+
+def incr(name, value = 1):
+    if enabled:
+        for collector in collectors:
+            collector.incr(name, value)
+
+
+class _Timer(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        timing(self.name, time.time() - self.started)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        pass
+
+_null_timer = _NullTimer()
+
+
+def timer(name):
+    if not enabled:
+        return _null_timer
+    return _Timer(name)
+
+
+"""
+Zapytanie jest logowane w skladni backendu (do odtworzenia przez
+search.warmup), a gdy backend nie umie go zapisac tekstem (np. zakresy
+xapiana) - jako unicode(query). Logowanie nigdy nie rzuca wyjatku.
+"""
+def log_slow_query(engine, query, order, seconds):
+    try:
+        try:
+            text = query.toString(engine)
+        except Exception:
+            text = unicode(query)
+        slow_query_log.warning("%.3fs %s order=%r", seconds, text, order)
+    except Exception:
+        slow_query_log.debug("slow query could not be logged", exc_info = True)
+
+
+class MemoryCollector(object):
+    """
+    Agreguje czasy i liczniki w pamieci procesu - do odczytu przez wlasny
+    endpoint metryk (np. w formacie Prometheusa).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timings = {}
+
+    def timing(self, name, seconds):
+        with self.lock:
+            count, total, maximum = self.timings.get(name, (0, 0.0, 0.0))
+            self.timings[name] = (count + 1, total + seconds, max(maximum, seconds))
+
+    def incr(self, name, value = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return {"counters": dict(self.counters), "timings": dict(self.timings)}
+
+
+class StatsdCollector(object):
+    """
+    Wysyla metryki protokolem statsd (UDP)
+    """
+    def __init__(self, host = "localhost", port = 8125, prefix = "search"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, line):
+        try:
+            self.socket.sendto(line.encode("utf-8"), self.address)
+        except socket.error:
+            pass
+
+    def timing(self, name, seconds):
+        self.send("%s.%s:%d|ms" % (self.prefix, name, seconds * 1000))
+
+    def incr(self, name, value = 1):
+        self.send("%s.%s:%d|c" % (self.prefix, name, value))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+from search.database import Database
+
+
+def human_size(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            return "%.1f %s" % (size, unit)
+        size /= 1024.0
+
+
+class Command(BaseCommand):
+    args = "<database class> <dbname> [<dbname> ...]"
+    help = "Merges all segments of the given search databases and reports segment count and size before and after."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--engine", dest = "engine", default = "default",
+            help = "Engine name from settings.SEARCH"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) < 2:
+            raise CommandError("Usage: search_optimize %s" % self.args)
+
+        try:
+            database_class = Database.load_backend(args[0])
+        except (ImportError, AttributeError, ValueError) as e:
+            raise CommandError("Cannot import %s: %s" % (args[0], e))
+
+        for dbname in args[1:]:
+            database = database_class(dbname, options["engine"])
+            stats = database.optimize()
+            database.close()
+            self.stdout.write("%s: segments %d -> %d, size %s -> %s\n" % (
+                dbname,
+                stats["before"]["segments"], stats["after"]["segments"],
+                human_size(stats["before"]["size"]), human_size(stats["after"]["size"])
+            ))
@@ -0,0 +1,202 @@
+from contextlib import contextmanager
+import threading
+import time
+
+
+class _Slot(object):
+    def __init__(self, resource):
+        self.resource  = resource
+        self.refs      = 0
+        self.last_used = time.time()
+        self.retired   = False
+
+
+class Pool(object):
+    """
+    Wspoldzielona w ramach procesu pula "cieplych" zasobow backendow
+    (searcherow, polaczen), kluczowana np. przez (backend, sciezka indeksu).
+
+    get() zwraca obiekty dlugowieczne (indeksy, cache, watki) - pula nigdy
+    ich nie zamyka sama, po ttl sekund bez uzycia jedynie o nich zapomina.
+
+    lease() wypozycza zasob, ktory trzeba zamykac (searcher, polaczenie),
+    na czas jednej operacji:
+
+        with pool.lease(key, factory, refresh, ttl) as searcher:
+            ...
+
+    Zasob jest zamykany dopiero wtedy, gdy nikt go nie wypozycza - po ttl
+    sekundach bez uzycia albo gdy zostal zastapiony. refresh (opcjonalny)
+    dostaje zasob i zwraca ten sam albo nowy (np. po zmianie generacji
+    indeksu) - nie moze zmieniac ani zamykac starego, bo inne watki moga
+    jeszcze z niego korzystac. shared = False daje kazdemu wypozyczajacemu
+    osobny egzemplarz (dla zasobow, ktorych nie mozna uzywac z wielu watkow
+    naraz) - wolne egzemplarze sa wspoldzielone przez wszystkie watki.
+
+    factory i refresh sa wywolywane poza globalna blokada puli (pod blokada
+    klucza), wiec otwieranie jednego indeksu nie wstrzymuje pozostalych.
+    """
+    def __init__(self):
+        self.objects = {}
+        self.slots = {}
+        self.key_locks = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, factory, ttl = None):
+        now = time.time()
+        with self.lock:
+            closing = self._evict(now)
+            entry = self.objects.get(key)
+            if entry is not None:
+                self.objects[key] = (entry[0], now, ttl)
+        self._close_all(closing)
+        if entry is not None:
+            return entry[0]
+
+        with self._key_lock(key):
+            with self.lock:
+                entry = self.objects.get(key)
+            resource = entry[0] if entry is not None else factory()
+            with self.lock:
+                self.objects[key] = (resource, time.time(), ttl)
+        return resource
+
+    @contextmanager
+    def lease(self, key, factory, refresh = None, ttl = 300, shared = True):
+        if shared:
+            slot = self._acquire_shared(key, factory, refresh, ttl)
+        else:
+            slot = self._acquire_exclusive(key, factory, refresh, ttl)
+        try:
+            yield slot.resource
+        finally:
+            self._release(slot)
+
+    def _acquire_shared(self, key, factory, refresh, ttl):
+        with self._key_lock(key):
+            with self.lock:
+                closing = self._evict(time.time())
+                slots = self.slots.setdefault(key, ([], ttl))[0]
+                slot = slots[0] if slots else None
+                if slot is not None:
+                    slot.refs += 1
+            self._close_all(closing)
+
+            if slot is None:
+                slot = self._add_slot(key, factory(), ttl)
+            elif refresh is not None:
+                resource = refresh(slot.resource)
+                if resource is not slot.resource:
+                    old = slot
+                    slot = self._add_slot(key, resource, ttl, replace = old)
+                    self._release(old)
+        return slot
+
+    def _acquire_exclusive(self, key, factory, refresh, ttl):
+        with self.lock:
+            closing = self._evict(time.time())
+            slots = self.slots.setdefault(key, ([], ttl))[0]
+            slot = None
+            for idle in slots:
+                if idle.refs == 0:
+                    slot = idle
+                    slot.refs = 1
+                    break
+        self._close_all(closing)
+
+        if slot is None:
+            with self._key_lock(key):
+                return self._add_slot(key, factory(), ttl)
+        if refresh is not None:
+            #egzemplarz jest wypozyczony na wylacznosc - mozna go podmienic
+            resource = refresh(slot.resource)
+            if resource is not slot.resource:
+                self._close(slot.resource)
+                slot.resource = resource
+        return slot
+
+    def _add_slot(self, key, resource, ttl, replace = None):
+        slot = _Slot(resource)
+        slot.refs = 1
+        with self.lock:
+            slots = self.slots.setdefault(key, ([], ttl))[0]
+            if replace is not None and replace in slots:
+                replace.retired = True
+                slots.remove(replace)
+            slots.insert(0, slot)
+            self.slots[key] = (slots, ttl)
+        return slot
+
+    def _release(self, slot):
+        with self.lock:
+            slot.refs -= 1
+            slot.last_used = time.time()
+            closing = slot.retired and slot.refs == 0
+        if closing:
+            self._close(slot.resource)
+
+    def _key_lock(self, key):
+        with self.lock:
+            lock = self.key_locks.get(key)
+            if lock is None:
+                lock = self.key_locks[key] = threading.Lock()
+            return lock
+
+    def discard(self, key):
+        with self.lock:
+            entry = self.objects.pop(key, None)
+            closing = self._retire(self.slots.pop(key, ([], None))[0])
+        if entry is not None:
+            closing.append(entry[0])
+        self._close_all(closing)
+
+    def clear(self):
+        with self.lock:
+            objects = self.objects
+            self.objects = {}
+            closing = []
+            for slots, ttl in self.slots.values():
+                closing.extend(self._retire(slots))
+            self.slots = {}
+        closing.extend(resource for resource, last_used, ttl in objects.values())
+        self._close_all(closing)
+
+    """
+    Wywolywane pod blokada puli - zwraca zasoby do zamkniecia (poza blokada)
+    """
+    def _evict(self, now):
+        for key, (resource, last_used, ttl) in list(self.objects.items()):
+            if ttl is not None and now - last_used > ttl:
+                del self.objects[key]
+        closing = []
+        for key, (slots, ttl) in list(self.slots.items()):
+            if ttl is None:
+                continue
+            idle = [slot for slot in slots if slot.refs == 0 and now - slot.last_used > ttl]
+            if idle:
+                closing.extend(self._retire(idle))
+                self.slots[key] = ([slot for slot in slots if slot not in idle], ttl)
+        return closing
+
+    def _retire(self, slots):
+        closing = []
+        for slot in slots:
+            slot.retired = True
+            if slot.refs == 0:
+                closing.append(slot.resource)
+        return closing
+
+    def _close_all(self, resources):
+        for resource in resources:
+            self._close(resource)
+
+    def _close(self, resource):
+        close = getattr(resource, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+
+pool = Pool()
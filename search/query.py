@@ -1,3 +1,42 @@
+from collections import namedtuple
+
+"""
+Tekst zapytania jako unicode - wartosci str sa w utf-8
+"""
+def _unicode(value):
+    if type(value) == str:
+        return unicode(value, "utf-8")
+    return unicode(value)
+
+"""
+Zakres dla jednego pola wyciagniety z zapytania - nakladany przez backend
+jako natywny filtr (bez liczenia trafnosci i parsowania tekstu). Brakujaca
+granica to None.
+"""
+Range = namedtuple("Range", ["field", "start", "start_inclusive", "end", "end_inclusive"])
+
+"""
+Czesc wspolna dwoch zakresow na tym samym polu
+"""
+def intersect(first, second):
+    start, start_inclusive = first.start, first.start_inclusive
+    if second.start is not None and (start is None or second.start > start or
+                                     (second.start == start and not second.start_inclusive)):
+        start, start_inclusive = second.start, second.start_inclusive
+    end, end_inclusive = first.end, first.end_inclusive
+    if second.end is not None and (end is None or second.end < end or
+                                   (second.end == end and not second.end_inclusive)):
+        end, end_inclusive = second.end, second.end_inclusive
+    return Range(first.field, start, start_inclusive, end, end_inclusive)
+
+
+def is_empty(_range):
+    if _range.start is None or _range.end is None:
+        return False
+    if _range.start == _range.end:
+        return not (_range.start_inclusive and _range.end_inclusive)
+    return _range.start > _range.end
+
 class Conjunction:
     AND = " AND "
     OR  = " OR "
@@ -17,8 +56,11 @@ class Condition:
         self.value    = value
         self.operator = operator
 
+    def __unicode__(self):
+        return u"%s %s %s" % (_unicode(self.field), self.operator, _unicode(self.value))
+
     def __str__(self):
-        return "%s %s %s" % (self.field, self.operator, self.value)
+        return unicode(self).encode("utf-8")
 
     def toString(self, engine):
         return engine.parseQueryCondition(self)
@@ -47,12 +89,18 @@ class Query:
                     operator = self.operators["__" + field[1]]
             self.conditions.append(Condition(f, value, operator))
 
-    def __str__(self):
-        _repr = self.conjunction.join(str(cond) for cond in self.conditions)
+    """
+    str(query) to utf-8 tego samego tekstu - jest czescia klucza cache wynikow
+    """
+    def __unicode__(self):
+        _repr = self.conjunction.join(unicode(cond) for cond in self.conditions)
         if self.subqueries:
-            _repr += self.conjunction + "(" + self.conjunction.join([str(sq) for sq in self.subqueries]) + ")"
+            _repr += self.conjunction + u"(" + self.conjunction.join([unicode(sq) for sq in self.subqueries]) + u")"
         return _repr
 
+    def __str__(self):
+        return unicode(self).encode("utf-8")
+
     def toString(self, engine):
         conditions_str = []
         for cond in self.conditions:
@@ -63,8 +111,9 @@ class Query:
         _repr = self.conjunction.join(conditions_str)
 
         if self.subqueries:
+            #podzapytania w calosci przeniesione do filtrow daja pusty tekst
             subq_str = self.conjunction.join(
-                [sq.toString(engine) for sq in self.subqueries]
+                [s for s in (sq.toString(engine) for sq in self.subqueries) if s.strip()]
             )
             if len(subq_str.strip()):
                 if len(_repr.strip()) > 0:
@@ -75,3 +124,19 @@ class Query:
 
 class OR(Query):
     conjunction = Conjunction.OR
+
+class RawQuery(Query):
+    """
+    Zapytanie zapisane juz w skladni backendu (np. odczytane z logu wolnych
+    zapytan search.slowquery) - toString zwraca je bez zmian.
+    """
+    def __init__(self, query):
+        Query.__init__(self)
+        self.query = query
+
+    #inny niz tekst dowolnego Query - str(query) jest czescia klucza cache wynikow
+    def __unicode__(self):
+        return u"raw:" + _unicode(self.query)
+
+    def toString(self, engine):
+        return self.query
@@ -0,0 +1,266 @@
+from search import instrumentation
+import atexit
+import logging
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger("search.scheduler")
+
+_WRITE  = "write"
+_COMMIT = "commit"
+_CALL   = "call"
+_CLOSE  = "close"
+
+
+"""
+Liczba dokumentow zapisywanych przez operacje (remove nie jest zapisem)
+"""
+def written(method, args):
+    if method.endswith("_many"):
+        return len(args[0])
+    if method == "remove":
+        return 0
+    return 1
+
+
+class Submission(object):
+    """
+    Wynik jednej operacji przekazanej do CommitScheduler. Zapis jest
+    zakonczony (done) dopiero po commicie, ktory go obejmuje - albo po
+    bledzie, ktory trafia tylko do jego zglaszajacego. result() czeka na
+    zakonczenie i rzuca ten blad.
+
+    add_done_callback() rejestruje funkcje wywolywana z Submission po
+    zakonczeniu - na watku schedulera, przed on_commit. Anulowanie jej nie
+    wywoluje.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.started = False
+        self.cancelled = False
+        self.value = None
+        self.error = None
+        self.callbacks = []
+
+    """
+    Anuluje operacje, ktora jeszcze czeka w kolejce. Zwraca False, jesli
+    watek schedulera zdazyl ja juz wykonac.
+    """
+    def cancel(self):
+        with self.lock:
+            if self.started:
+                return False
+            self.cancelled = True
+            self.callbacks = []
+            self.event.set()
+        return True
+
+    def start(self):
+        with self.lock:
+            if self.cancelled:
+                return False
+            self.started = True
+            return True
+
+    def done(self):
+        return self.event.is_set()
+
+    def result(self, timeout = None):
+        if not self.event.wait(timeout):
+            raise RuntimeError("search commit scheduler: timed out")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def add_done_callback(self, callback):
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+            if self.cancelled:
+                return
+        callback(self)
+
+    def finish(self, value = None, error = None):
+        self.value = value
+        self.error = error
+        with self.lock:
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                logger.exception("search commit scheduler: callback failed")
+
+
+class CommitScheduler(object):
+    """
+    Kolejka zapisow z watkiem w tle. Operacje zapisu (nazwy metod backendu
+    z argumentami) sa wykonywane na osobnej instancji backendu, a commit()
+    nastepuje co interval sekund lub po max_pending dokumentach - wiele
+    malych zapisow daje jeden commit. Po kazdym commicie wywolywane jest
+    on_commit.
+
+    submit() zwraca Submission - blad zapisu albo commitu, ktory go
+    obejmuje, dostaje tylko jego zglaszajacy. Kolejka ma najwyzej
+    max_queue operacji, przy pelnej submit() czeka. flush(wait = True)
+    wymusza natychmiastowy commit i czeka na niego (read-your-writes).
+    call() wykonuje na instancji schedulera operacje wymagajaca writera na
+    wylacznosc (rebuild, optimize) - po zatwierdzeniu oczekujacych zapisow.
+
+    Scheduler jest wspoldzielony przez wszystkie instancje bazy w procesie,
+    wiec nie ma wspolnego rollback - zglaszajacy moze tylko anulowac swoje
+    operacje, ktore jeszcze czekaja w kolejce (Submission.cancel).
+
+    close() zatwierdza wszystko, co czeka w kolejce, i zatrzymuje watek -
+    wywolywane przy wyjsciu z procesu (atexit) i przy usunieciu z puli.
+    """
+    def __init__(self, engine, interval = 2.0, max_pending = 5000, max_queue = 1000, on_commit = None):
+        self.engine = engine
+        self.on_commit = on_commit
+        self.interval = interval
+        self.max_pending = max_pending
+        self.queue = queue.Queue(max_queue)
+        self.pending = 0
+        self.uncommitted = []
+        self.commits = 0
+        self.commit_time = 0.0
+        self.last_commit_latency = 0.0
+        self.closed = False
+        self.close_lock = threading.Lock()
+        self.thread = threading.Thread(target = self.run, name = "search-commit-scheduler")
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, method, *args):
+        return self._put(_WRITE, method, args)
+
+    def call(self, method, *args):
+        return self._put(_CALL, method, args)
+
+    def flush(self, wait = True):
+        submission = self._put(_COMMIT, None, ())
+        if wait:
+            submission.result()
+        return submission
+
+    def close(self, timeout = None):
+        with self.close_lock:
+            if self.closed:
+                return
+            self.closed = True
+        submission = Submission()
+        self.queue.put((_CLOSE, None, (), submission))
+        try:
+            submission.result(timeout)
+        finally:
+            self.thread.join(timeout)
+            self.engine.close()
+
+    def _put(self, kind, method, args):
+        if self.closed:
+            raise RuntimeError("search commit scheduler: closed")
+        submission = Submission()
+        self.queue.put((kind, method, args, submission))
+        return submission
+
+    def run(self):
+        deadline = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.time())
+            try:
+                kind, method, args, submission = self.queue.get(timeout = timeout)
+            except queue.Empty:
+                kind, method, args, submission = _COMMIT, None, (), None
+
+            if submission is not None and not submission.start():
+                continue
+
+            if kind == _WRITE:
+                try:
+                    getattr(self.engine, method)(*args)
+                except Exception as e:
+                    logger.exception("search commit scheduler: %s failed", method)
+                    submission.finish(error = e)
+                    continue
+                self.uncommitted.append(submission)
+                instrumentation.incr("documents.indexed", written(method, args))
+                if method.endswith("_many"):
+                    self.pending += len(args[0])
+                else:
+                    self.pending += 1
+                if deadline is None:
+                    deadline = time.time() + self.interval
+                if self.pending < self.max_pending:
+                    continue
+
+            error = None
+            if self.uncommitted:
+                error = self.commit()
+            deadline = None
+
+            if kind == _CALL:
+                if error is None:
+                    try:
+                        submission.finish(getattr(self.engine, method)(*args))
+                    except Exception as e:
+                        logger.exception("search commit scheduler: %s failed", method)
+                        submission.finish(error = e)
+                else:
+                    submission.finish(error = error)
+            elif kind == _COMMIT and submission is not None:
+                submission.finish(error = error)
+            elif kind == _CLOSE:
+                submission.finish(error = error)
+                return
+
+    """
+    Zatwierdza wykonane zapisy i konczy ich Submission. Po nieudanym
+    commicie zapisy sa odrzucane (rollback backendu), a blad dostaja
+    wszyscy, ktorych zapisy obejmowal. Zwraca ten blad.
+    """
+    def commit(self):
+        submissions, self.uncommitted = self.uncommitted, []
+        self.pending = 0
+        started = time.time()
+        try:
+            self.engine.commit()
+        except Exception as e:
+            logger.exception("search commit scheduler: commit failed")
+            try:
+                self.engine.rollback()
+            except Exception:
+                logger.exception("search commit scheduler: rollback failed")
+            for submission in submissions:
+                submission.finish(error = e)
+            return e
+        self.last_commit_latency = time.time() - started
+        self.commit_time += self.last_commit_latency
+        self.commits += 1
+        for submission in submissions:
+            submission.finish()
+        if self.on_commit is not None:
+            try:
+                self.on_commit()
+            except Exception:
+                logger.exception("search commit scheduler: on_commit failed")
+        return None
+
+    def stats(self):
+        return {
+            "queue_depth"        : self.queue.qsize(),
+            "pending"            : self.pending,
+            "commits"            : self.commits,
+            "last_commit_latency": self.last_commit_latency,
+            "avg_commit_latency" : self.commit_time / self.commits if self.commits else 0.0,
+        }
@@ -0,0 +1,50 @@
+import threading
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+class CompiledSchema(object):
+    """
+    Niezmienny, skompilowany schemat bazy dla konkretnego backendu - krotki
+    pol, zbiory pol do szybkiego sprawdzania przynaleznosci i tablice
+    konwersji typow. Jest budowany raz i wspoldzielony przez wszystkie
+    instancje backendu (rowniez pomiedzy watkami), wiec nie wolno go
+    modyfikowac.
+    """
+    def __init__(self, **attributes):
+        for name, value in attributes.items():
+            if type(value) == list:
+                value = tuple(value)
+            elif type(value) == set:
+                value = frozenset(value)
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledSchema is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("CompiledSchema is read-only")
+
+
+def schema_key(schema):
+    return tuple(sorted(
+        (field, type(field_type), field_type.store, field_type.analyze, field_type.sort, field_type.split_to_terms)
+        for field, field_type in schema.items()
+    ))
+
+
+"""
+Zwraca skompilowany schemat dla pary (klasa backendu, schemat bazy).
+convert(schema) jest wywolywane tylko przy pierwszym uzyciu i zwraca
+slownik atrybutow CompiledSchema.
+"""
+def compile_schema(backend, schema, convert):
+    key = (backend, schema_key(schema))
+    compiled = _compiled.get(key)
+    if compiled is None:
+        with _compiled_lock:
+            compiled = _compiled.get(key)
+            if compiled is None:
+                compiled = _compiled[key] = CompiledSchema(**convert(schema))
+    return compiled
@@ -0,0 +1,309 @@
+"""
+Baza podzielona na shardy.
+
+Dokumenty sa rozdzielane pomiedzy shard_count zwyklych indeksow backendu
+(prefix/dbname/shard00, shard01, ...) wedlug skrotu uuid. Zapisy trafiaja
+do shardu, do ktorego nalezy dokument, a wyszukiwanie jest wykonywane na
+wszystkich shardach rownolegle (w puli watkow), po czym trafienia sa
+scalane wedlug order (dla pol z sort = True - wedlug klucza __isort) przed
+wycieciem zadanej strony. Bez order trafienia sa przeplatane po kolei
+z kazdego shardu - trafnosci z roznych indeksow nie sa porownywalne.
+Pola uzyte w order musza byc przechowywane (store = True).
+
+    class ProductDatabase(ShardedDatabase):
+        prefix      = "products"
+        shard_count = 8
+        ...
+"""
+from search.database import Database, DatabaseBackend, SearchResult
+from search.document import Fields, collation_key
+from search.pool import pool
+
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import os.path
+import threading
+import zlib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+_END   = object()
+_ABORT = object()
+
+
+class RebuildAborted(Exception):
+    pass
+
+
+class ShardedDatabase(Database):
+    shard_count   = 4
+    #liczba watkow wyszukiwania, domyslnie shard_count
+    shard_threads = None
+
+    def create_engine(self, backend, params, search):
+        shards = []
+        for number in range(self.shard_count):
+            shard_params = dict(params, name = "%s/shard%02d" % (params["name"], number))
+            shards.append(Database.create_engine(self, backend, shard_params, search))
+        sort_fields = [
+            field for field, field_type in self.schema.items()
+            if type(field_type) == Fields.CharField and field_type.sort
+        ]
+        sharded = ShardedBackend(shards, sort_fields, self.shard_threads or self.shard_count)
+        return self.configure_engine(sharded, search)
+
+
+class ShardedBackend(DatabaseBackend):
+    """
+    Backend rozsylajacy operacje do backendow shardow
+    """
+    #najwyzej tyle dokumentow czeka w kolejce kazdego shardu przy rebuild
+    rebuild_queue_size = 1000
+
+    def __init__(self, shards, sort_fields, threads):
+        self.shards      = shards
+        self.sort_fields = frozenset(sort_fields)
+        self.threads     = threads
+
+    def map(self, function, items):
+        threads = pool.get(("sharding.threads", self.threads), lambda: ThreadPool(self.threads), ttl = None)
+        return threads.map(function, items)
+
+    """
+    Numer shardu dla uuid - crc32 jest staly pomiedzy procesami (w odroznieniu
+    od hash()), wiec podzial nie zmienia sie po restarcie.
+    """
+    def shard_for(self, uuid):
+        if type(uuid) == unicode:
+            uuid = uuid.encode("utf-8")
+        return self.shards[(zlib.crc32(uuid) & 0xffffffff) % len(self.shards)]
+
+    def partition(self, documents):
+        parts = dict((id(shard), []) for shard in self.shards)
+        for document in documents:
+            parts[id(self.shard_for(document.get_uuid()))].append(document)
+        return [(shard, parts[id(shard)]) for shard in self.shards if parts[id(shard)]]
+
+    def add(self, document):
+        return self.shard_for(document.get_uuid()).add(document)
+
+    def replace(self, uuid, document):
+        return self.shard_for(uuid).replace(uuid, document)
+
+    def remove(self, uuid):
+        return self.shard_for(uuid).remove(uuid)
+
+    def add_many(self, documents):
+        self.map(lambda part: part[0].add_many(part[1]), self.partition(documents))
+
+    def replace_many(self, documents):
+        self.map(lambda part: part[0].replace_many(part[1]), self.partition(documents))
+
+    """
+    Kazdy shard jest przebudowywany rownolegle (we wlasnym watku, z czescia
+    procesow) z ograniczonej kolejki, do ktorej documents sa rozdzielane
+    strumieniowo - w pamieci jest najwyzej rebuild_queue_size dokumentow na
+    shard. Blad zrodla albo ktoregokolwiek shardu przerywa przebudowe
+    shardow, ktore jeszcze jej nie zatwierdzily, i jest rzucany dalej.
+    """
+    def rebuild(self, documents, procs = None, merge = True):
+        procs = max(1, (procs or cpu_count()) // len(self.shards))
+        queues = dict((id(shard), queue.Queue(self.rebuild_queue_size)) for shard in self.shards)
+        errors = []
+
+        def run(shard, documents_queue):
+            markers = []
+
+            def consume():
+                while True:
+                    document = documents_queue.get()
+                    if document is _END or document is _ABORT:
+                        markers.append(document)
+                        if document is _ABORT:
+                            raise RebuildAborted()
+                        return
+                    yield document
+
+            try:
+                shard.rebuild(consume(), procs = procs, merge = merge)
+            except RebuildAborted:
+                pass
+            except Exception as e:
+                errors.append(e)
+            #zrodlo nie moze utknac na pelnej kolejce
+            while not markers:
+                document = documents_queue.get()
+                if document is _END or document is _ABORT:
+                    markers.append(document)
+
+        threads = [
+            threading.Thread(target = run, args = (shard, queues[id(shard)]), name = "search-rebuild-%d" % number)
+            for number, shard in enumerate(self.shards)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        marker = _ABORT
+        try:
+            for document in documents:
+                if errors:
+                    break
+                queues[id(self.shard_for(document.get_uuid()))].put(document)
+            else:
+                marker = _END
+        finally:
+            for documents_queue in queues.values():
+                documents_queue.put(marker)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+    def commit(self):
+        self.map(lambda shard: shard.commit(), self.shards)
+
+    def rollback(self):
+        for shard in self.shards:
+            shard.rollback()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def optimize(self):
+        stats = self.map(lambda shard: shard.optimize(), self.shards)
+        return {
+            "before": self.sum_stats([shard_stats["before"] for shard_stats in stats]),
+            "after" : self.sum_stats([shard_stats["after"] for shard_stats in stats]),
+        }
+
+    def sum_stats(self, stats):
+        out = {}
+        for shard_stats in stats:
+            for key, value in shard_stats.items():
+                out[key] = out.get(key, 0) + value
+        return out
+
+    def find(self, query, order = None):
+        return ShardedSearchResult(self, [shard.find(query, order) for shard in self.shards], order)
+
+    def get_many(self, uuids):
+        parts = {}
+        for uuid in uuids:
+            shard = self.shard_for(uuid)
+            parts.setdefault(id(shard), (shard, []))[1].append(uuid)
+        out = {}
+        for found in self.map(lambda part: part[0].get_many(part[1]), parts.values()):
+            out.update(found)
+        return out
+
+    def count(self, query):
+        return sum(self.map(lambda shard: shard.count(query), self.shards))
+
+    """
+    Najczestsze wartosci w calej bazie nie musza byc najczestsze w kazdym
+    shardzie, dlatego z shardow pobierane sa pelne liczniki (limit = None).
+    """
+    def facets(self, query, fields, limit = 100):
+        out = dict((field, {}) for field in fields)
+        for shard_facets in self.map(lambda shard: shard.facets(query, fields, None), self.shards):
+            for field, counts in shard_facets.items():
+                for value, count in counts.items():
+                    out[field][value] = out[field].get(value, 0) + count
+        return dict((field, self.top_counts(counts, limit)) for field, counts in out.items())
+
+    """
+    Jeden plik odciskow dla calej bazy - obok katalogu shardow
+    """
+    def fingerprint_path(self):
+        path = self.shards[0].fingerprint_path()
+        if path is None:
+            return None
+        return os.path.dirname(path) + ".fingerprints"
+
+    def warmup(self):
+        self.map(lambda shard: shard.warmup(), self.shards)
+
+    def index_files(self):
+        return [path for shard in self.shards for path in shard.index_files()]
+
+    def generation(self):
+        generations = tuple(shard.generation() for shard in self.shards)
+        if None in generations:
+            return None
+        return generations
+
+    def stored_data(self, stored):
+        return self.shards[0].stored_data(stored)
+
+    def stored_value(self, stored, field):
+        return self.shards[0].stored_value(stored, field)
+
+
+class ShardedSearchResult(SearchResult):
+    def __init__(self, engine, results, order):
+        self.engine  = engine
+        self.results = results
+        self.order   = order
+
+    """
+    Scala listy trafien shardow. offsets to pozycje, od ktorych pobrano
+    listy - przy braku order trafienia sa przeplatane wedlug pozycji
+    w shardzie.
+    """
+    def merge(self, pages, offsets):
+        entries = []
+        for shard, page in enumerate(pages):
+            for rank, stored in enumerate(page):
+                entries.append((offsets[shard] + rank, shard, stored))
+        entries.sort(key = lambda entry: (entry[0], entry[1]))
+        for field, sort_order in reversed(list((self.order or {}).items())):
+            entries.sort(key = lambda entry: self.sort_key(field, entry[2]), reverse = (sort_order == "desc"))
+        return entries
+
+    def sort_key(self, field, stored):
+        value = self.engine.stored_value(stored, field)
+        if field in self.engine.sort_fields:
+            return (False, collation_key(value))
+        return (value is None, value)
+
+    def _stored(self, start, limit):
+        pages = self.engine.map(lambda result: result._stored(0, start + limit), self.results)
+        self.rows = sum(result.rows for result in self.results)
+        entries = self.merge(pages, [0] * len(pages))
+        return [stored for rank, shard, stored in entries[start:start + limit]]
+
+    """
+    Kursorem jest krotka pozycji w kazdym z shardow
+    """
+    def _after(self, cursor, limit):
+        offsets = list(cursor or [0] * len(self.results))
+        pages = self.engine.map(
+            lambda shard: self.results[shard]._stored(offsets[shard], limit),
+            range(len(self.results))
+        )
+        self.rows = sum(result.rows for result in self.results)
+
+        entries = self.merge(pages, offsets)
+        hits = []
+        for rank, shard, stored in entries[:limit]:
+            offsets[shard] += 1
+            hits.append(self.engine.stored_data(stored))
+
+        if len(entries) <= limit and all(len(page) < limit for page in pages):
+            return hits, None
+        return hits, tuple(offsets)
+
+    def free(self):
+        for result in self.results:
+            result.free()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.free()
@@ -0,0 +1,20 @@
+"""
+Testy zachowania - glownie na backendzie memory (bez zewnetrznych
+bibliotek); testy whoosha sa pomijane, jesli nie jest zainstalowany.
+
+    python manage.py test search
+"""
+from search.tests.test_pool import *
+from search.tests.test_ranges import *
+from search.tests.test_sharding import *
+from search.tests.test_snapshots import *
+from search.tests.test_merge import *
+from search.tests.test_sort_keys import *
+from search.tests.test_scheduler import *
+from search.tests.test_fingerprints import *
+from search.tests.test_instrumentation import *
+from search.tests.test_cursor import *
+from search.tests.test_cache import *
+from search.tests.test_facets import *
+from search.tests.test_compiler import *
+from search.tests.test_bulk import *
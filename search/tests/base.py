@@ -0,0 +1,94 @@
+from django.db import settings
+from search.database import Database
+from search.document import Document, Fields
+from search.pool import pool
+
+import itertools
+import shutil
+import tempfile
+import unittest
+
+try:
+    import whoosh
+except ImportError:
+    whoosh = None
+
+_names = itertools.count()
+
+
+class Product(Document):
+    pass
+
+
+class ProductDatabase(Database):
+    prefix   = "products"
+    document = Product
+    schema   = {
+        "uuid"    : Fields.UUIDField(store = True),
+        "title"   : Fields.CharField(store = True, sort = True),
+        "category": Fields.CharField(store = True, split_to_terms = False),
+        "price"   : Fields.IntegerField(store = True),
+    }
+
+
+def products(count, start = 0):
+    for number in range(start, start + count):
+        yield Product({
+            "uuid"    : u"p%04d" % number,
+            "title"   : u"Product %d %s" % (number, u"red" if number % 2 else u"blue"),
+            "category": u"c%d" % (number % 3),
+            "price"   : number,
+        })
+
+
+class SearchTestCase(unittest.TestCase):
+    """
+    Podmienia settings.SEARCH na czas testu. Bazy dostaja unikalne nazwy,
+    bo indeksy backendu memory i obiekty puli sa wspolne dla procesu.
+    """
+    engines = {
+        "memory": {"backend": "search.backends.memory.Backend"},
+    }
+
+    def setUp(self):
+        self.saved_search = getattr(settings, "SEARCH", None)
+        settings.SEARCH = self.engines
+
+    def tearDown(self):
+        pool.clear()
+        settings.SEARCH = self.saved_search
+
+    def unique_name(self):
+        return "test%d" % next(_names)
+
+    def database(self, engine = "memory", database_class = ProductDatabase, name = None):
+        return database_class(name or self.unique_name(), engine)
+
+    def fill(self, database, count):
+        database.add_many(products(count))
+        database.commit()
+        return database
+
+    def uuids(self, documents):
+        return [document.data["uuid"] for document in documents]
+
+
+@unittest.skipIf(whoosh is None, "whoosh is not installed")
+class WhooshTestCase(SearchTestCase):
+    """
+    Silniki whoosha w katalogu tymczasowym - whoosh_engines to
+    {silnik: parametry backendu oprocz index_dir}
+    """
+    whoosh_engines = {"plain": {}}
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.engines = dict(
+            (engine, {"backend": "search.backends.whoosh.Backend", "params": dict(params, index_dir = self.index_dir)})
+            for engine, params in self.whoosh_engines.items()
+        )
+        SearchTestCase.setUp(self)
+
+    def tearDown(self):
+        SearchTestCase.tearDown(self)
+        shutil.rmtree(self.index_dir)
@@ -0,0 +1,43 @@
+from search.query import Query
+from search.tests.base import SearchTestCase, WhooshTestCase, products
+
+
+class BulkIndexingTest(SearchTestCase):
+    def test_add_many_writes_in_batches(self):
+        database = self.database()
+        batches = []
+        add_many = database.engine.add_many
+
+        def record(documents):
+            batches.append(len(documents))
+            return add_many(documents)
+        database.engine.add_many = record
+        result = database.add_many(products(7), batch_size = 3)
+        self.assertEqual((result.count, batches), (7, [3, 3, 1]))
+
+    def test_writes_are_visible_after_commit(self):
+        database = self.database()
+        database.add_many(products(4))
+        self.assertEqual(database.count(Query(title = u"product")), 0)
+        database.commit()
+        self.assertEqual(database.count(Query(title = u"product")), 4)
+
+    def test_replace_many_overwrites_documents(self):
+        database = self.fill(self.database(), 3)
+        documents = list(products(3))
+        documents[1].data["title"] = u"Product 1 green"
+        database.replace_many(documents)
+        database.commit()
+        self.assertEqual(database.count(Query(title = u"product")), 3)
+        self.assertEqual(self.uuids(database.find(Query(title = u"green")).page(1, 10)), [u"p0001"])
+
+
+class WhooshBulkIndexingTest(WhooshTestCase):
+    def test_replace_many_overwrites_documents(self):
+        database = self.fill(self.database("plain"), 3)
+        documents = list(products(3))
+        documents[1].data["title"] = u"Product 1 green"
+        database.replace_many(documents)
+        database.commit()
+        self.assertEqual(database.count(Query(title = u"product")), 3)
+        self.assertEqual(self.uuids(database.find(Query(title = u"green")).page(1, 10)), [u"p0001"])
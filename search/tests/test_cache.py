@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from search import instrumentation
+from search.query import Query, RawQuery
+from search.tests.base import SearchTestCase, WhooshTestCase, Product, products
+
+
+class CacheKeyTest(SearchTestCase):
+    def test_str_is_utf8_of_unicode(self):
+        query = Query(title = u"żółw")
+        self.assertEqual(str(query), u"title : żółw".encode("utf-8"))
+        self.assertEqual(unicode(query), u"title : żółw")
+
+    def test_raw_query_key_differs_from_query(self):
+        self.assertEqual(unicode(RawQuery(u"title:żółw")), u"raw:title:żółw")
+        self.assertNotEqual(str(RawQuery(u"title : x")), str(Query(title = u"x")))
+
+
+class ResultCacheTest(SearchTestCase):
+    engines = {
+        "cached": {"backend": "search.backends.memory.Backend", "result_cache": {"store": "local"}},
+    }
+
+    def setUp(self):
+        SearchTestCase.setUp(self)
+        self.collector = instrumentation.MemoryCollector()
+        instrumentation.register(self.collector)
+
+    def tearDown(self):
+        instrumentation.unregister(self.collector)
+        SearchTestCase.tearDown(self)
+
+    def searches(self):
+        return self.collector.snapshot()["timings"].get("search", (0, ))[0]
+
+    def test_repeated_page_is_served_from_cache(self):
+        database = self.fill(self.database("cached"), 10)
+        first = database.find(Query(title = u"red"), {"price": "asc"}).page(1, 3)
+        second = database.find(Query(title = u"red"), {"price": "asc"}).page(1, 3)
+        self.assertEqual(self.uuids(first), self.uuids(second))
+        self.assertEqual(self.searches(), 1)
+
+    def test_commit_invalidates_cached_pages(self):
+        database = self.fill(self.database("cached"), 4)
+        self.assertEqual(len(database.find(Query(title = u"red")).page(1, 10)), 2)
+        database.add_many(products(4, start = 4))
+        database.commit()
+        self.assertEqual(len(database.find(Query(title = u"red")).page(1, 10)), 4)
+
+    def test_non_ascii_queries_have_distinct_keys(self):
+        database = self.database("cached")
+        database.add(Product({"uuid": u"z1", "title": u"żółw", "category": u"c", "price": 1}))
+        database.add(Product({"uuid": u"z2", "title": u"żółwie", "category": u"c", "price": 2}))
+        database.commit()
+        self.assertEqual(self.uuids(database.find(Query(title = u"żółw")).page(1, 10)), [u"z1"])
+        self.assertEqual(self.uuids(database.find(Query(title = u"żółwie")).page(1, 10)), [u"z2"])
+        self.assertEqual(self.searches(), 2)
+
+    def test_order_is_part_of_the_key(self):
+        database = self.fill(self.database("cached"), 6)
+        ascending = database.find(Query(title = u"product"), {"price": "asc"}).page(1, 2)
+        descending = database.find(Query(title = u"product"), {"price": "desc"}).page(1, 2)
+        self.assertNotEqual(self.uuids(ascending), self.uuids(descending))
+
+    def test_commit_in_another_process_invalidates_cached_pages(self):
+        database = self.fill(self.database("cached"), 4)
+        self.assertEqual(len(database.find(Query(title = u"red")).page(1, 10)), 2)
+        #zapis z pominieciem Database.commit - jak commit innego procesu,
+        #ktory nie zmienia generacji w lokalnym magazynie
+        documents = list(products(4, start = 4))
+        for document in documents:
+            database.validate_document(document)
+        database.engine.add_many(documents)
+        database.engine.commit()
+        self.assertEqual(len(database.find(Query(title = u"red")).page(1, 10)), 4)
+
+
+class WhooshResultCacheTest(WhooshTestCase):
+    whoosh_engines = {"cached": {}}
+
+    def setUp(self):
+        WhooshTestCase.setUp(self)
+        self.engines["cached"]["result_cache"] = {"store": "local"}
+
+    def test_commit_in_another_process_invalidates_cached_pages(self):
+        name = self.unique_name()
+        database = self.fill(self.database("cached", name = name), 4)
+        self.assertEqual(len(database.find(Query(title = u"red")).page(1, 10)), 2)
+        writer = self.database("cached", name = name).engine
+        writer.add_many(list(products(4, start = 4)))
+        writer.commit()
+        self.assertEqual(len(database.find(Query(title = u"red")).page(1, 10)), 4)
@@ -0,0 +1,64 @@
+from search.compiler import QueryCompiler, ALL, NONE
+from search.query import Query, OR, RawQuery, Range
+from search.tests.base import SearchTestCase, WhooshTestCase
+
+
+class CompilerFoldTest(SearchTestCase):
+    def setUp(self):
+        SearchTestCase.setUp(self)
+        self.compiler = QueryCompiler(self.database().engine)
+
+    def test_empty_query_is_all(self):
+        self.assertEqual(self.compiler.fold(Query()), ALL)
+
+    def test_ranges_on_one_field_are_merged(self):
+        node = self.compiler.fold(Query(Query(price__gt = 2), price__le = 8))
+        self.assertEqual(node, ("range", Range("price", 2, False, 8, True)))
+
+    def test_empty_range_is_none(self):
+        self.assertEqual(self.compiler.fold(Query(Query(price__gt = 8), price__lt = 2)), NONE)
+
+    def test_nested_and_is_flattened_without_duplicates(self):
+        node = self.compiler.fold(Query(Query(title = u"red"), title = u"red", category = u"c1"))
+        self.assertEqual(node[0], "and")
+        self.assertEqual(sorted(node[1]), [
+            ("condition", "category", ":", u"c1"),
+            ("condition", "title", ":", u"red"),
+        ])
+
+    def test_or_with_all_is_all(self):
+        self.assertEqual(self.compiler.fold(OR(Query(), title = u"red")), ALL)
+
+    def test_raw_query_is_a_raw_node(self):
+        self.assertEqual(self.compiler.fold(RawQuery(u"title:red")), ("raw", u"title:red"))
+
+    def test_folded_queries_are_cache_keys(self):
+        cache = {self.compiler.fold(Query(Query(price__ge = 1), title = u"red")): "compiled"}
+        self.assertEqual(cache.get(self.compiler.fold(Query(Query(price__ge = 1), title = u"red"))), "compiled")
+
+
+class WhooshCompiledQueryTest(WhooshTestCase):
+    """
+    Roznice sciezki kompilowanej i tekstowej opisane w search.compiler
+    """
+    whoosh_engines = {"text": {}, "compiled": {}}
+
+    def setUp(self):
+        WhooshTestCase.setUp(self)
+        self.engines["compiled"]["compile_queries"] = True
+        name = self.unique_name()
+        self.text = self.fill(self.database("text", name = name), 6)
+        self.compiled = self.database("compiled", name = name)
+
+    def test_empty_query_matches_all_documents_only_when_compiled(self):
+        self.assertEqual(self.text.count(Query()), 0)
+        self.assertEqual(self.compiled.count(Query()), 6)
+
+    def test_every_word_of_a_condition_stays_in_its_field_when_compiled(self):
+        query = Query(title = u"product c1")
+        self.assertEqual(self.text.count(query), 2)
+        self.assertEqual(self.compiled.count(query), 0)
+
+    def test_single_word_conditions_agree(self):
+        query = Query(Query(price__ge = 2), title = u"red")
+        self.assertEqual(self.text.count(query), self.compiled.count(query))
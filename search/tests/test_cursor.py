@@ -0,0 +1,45 @@
+from search.query import Query
+from search.tests.base import SearchTestCase, WhooshTestCase
+
+
+class CursorPagingTest(SearchTestCase):
+    def test_pages_cover_all_hits_in_order(self):
+        database = self.fill(self.database(), 20)
+        pages = list(database.find(Query(title = u"product"), {"price": "desc"}).pages(7))
+        self.assertEqual([len(page) for page in pages], [7, 7, 6])
+        prices = [document.data["price"] for page in pages for document in page]
+        self.assertEqual(prices, list(range(19, -1, -1)))
+
+    def test_after_returns_none_at_the_end(self):
+        database = self.fill(self.database(), 5)
+        result = database.find(Query(title = u"red"), {"price": "asc"})
+        documents, cursor = result.after(None, 2)
+        self.assertEqual(self.uuids(documents), [u"p0001", u"p0003"])
+        documents, cursor = result.after(cursor, 2)
+        self.assertEqual(self.uuids(documents), [])
+        self.assertEqual(cursor, None)
+
+    def test_page_and_cursor_agree(self):
+        database = self.fill(self.database(), 12)
+        result = database.find(Query(title = u"product"), {"price": "asc"})
+        documents, cursor = result.after(None, 5)
+        documents, cursor = result.after(cursor, 5)
+        self.assertEqual(self.uuids(documents), self.uuids(result.page(2, 5)))
+
+
+class WhooshCursorPagingTest(WhooshTestCase):
+    def test_pages_free_the_searcher(self):
+        database = self.fill(self.database("plain"), 9)
+        result = database.find(Query(title = u"product"), {"price": "asc"})
+        pages = list(result.pages(4))
+        self.assertEqual([len(page) for page in pages], [4, 4, 1])
+        self.assertTrue(result._searcher is None)
+
+    def test_abandoned_pages_free_the_searcher(self):
+        database = self.fill(self.database("plain"), 9)
+        result = database.find(Query(title = u"product"), {"price": "asc"})
+        pages = result.pages(4)
+        self.assertEqual(len(next(pages)), 4)
+        self.assertTrue(result._searcher is not None)
+        pages.close()
+        self.assertTrue(result._searcher is None)
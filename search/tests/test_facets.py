@@ -0,0 +1,14 @@
+from search.query import Query
+from search.tests.base import SearchTestCase
+
+
+class FacetsTest(SearchTestCase):
+    def test_facets_count_values(self):
+        database = self.fill(self.database(), 10)
+        facets = database.facets(Query(title = u"product"), ["category"], 1)
+        self.assertEqual(facets, {"category": {u"c0": 4}})
+
+    def test_limit_none_returns_all_values(self):
+        database = self.fill(self.database(), 10)
+        facets = database.facets(Query(title = u"product"), ["category"], None)
+        self.assertEqual(facets, {"category": {u"c0": 4, u"c1": 3, u"c2": 3}})
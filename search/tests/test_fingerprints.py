@@ -0,0 +1,60 @@
+from search.query import Query
+from search.tests.base import SearchTestCase, Product, products
+
+
+class FingerprintSyncTest(SearchTestCase):
+    engines = {
+        "fingerprints": {"backend": "search.backends.memory.Backend", "fingerprints": True},
+        "scheduled"   : {
+            "backend": "search.backends.memory.Backend",
+            "fingerprints": True,
+            "commit_scheduler": {"interval": 60},
+        },
+    }
+
+    def test_sync_writes_only_changes(self):
+        database = self.database("fingerprints")
+        result = database.sync(products(10))
+        self.assertEqual((result.added, result.updated, result.skipped, result.removed), (10, 0, 0, 0))
+
+        documents = [document for document in products(10) if document.data["uuid"] != u"p0009"]
+        documents[0].data["title"] = u"Product 0 green"
+        documents.append(Product({"uuid": u"p0100", "title": u"Product 100", "category": u"c1", "price": 100}))
+        result = database.sync(documents)
+        self.assertEqual((result.added, result.updated, result.skipped, result.removed), (1, 1, 8, 1))
+
+        self.assertEqual(database.count(Query(title = u"product")), 10)
+        self.assertEqual(self.uuids(database.find(Query(title = u"green")).page(1, 10)), [u"p0000"])
+        self.assertEqual(database.get_many([u"p0009"]), [None])
+
+    def test_replace_many_skips_unchanged_documents(self):
+        database = self.database("fingerprints")
+        database.add_many(products(5))
+        database.commit()
+        result = database.replace_many(products(6))
+        self.assertEqual((result.count, result.skipped), (1, 5))
+
+    def test_failed_write_does_not_record_fingerprints(self):
+        database = self.database("fingerprints")
+
+        def fail(documents):
+            raise IOError("disk full")
+        database.engine.replace_many = fail
+        self.assertRaises(IOError, database.replace_many, products(3))
+        database.commit()
+        self.assertEqual(database.fingerprint_store.uuids(), set())
+
+    def test_failed_scheduled_write_does_not_record_fingerprints(self):
+        database = self.database("scheduled")
+
+        def fail(documents):
+            raise IOError("disk full")
+        database.scheduler.engine.replace_many = fail
+        database.replace_many(products(3))
+        self.assertRaises(IOError, database.commit)
+        self.assertEqual(database.fingerprint_store.uuids(), set())
+
+        del database.scheduler.engine.replace_many
+        database.replace_many(products(3))
+        database.commit()
+        self.assertEqual(database.fingerprint_store.uuids(), set([u"p0000", u"p0001", u"p0002"]))
@@ -0,0 +1,32 @@
+from search import instrumentation
+from search.query import Query
+
+import logging
+import unittest
+
+
+class FailingEngine(object):
+    def parseQueryCondition(self, condition):
+        raise ValueError("range conditions have no text form")
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class SlowQueryLogTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = RecordingHandler()
+        instrumentation.slow_query_log.addHandler(self.handler)
+
+    def tearDown(self):
+        instrumentation.slow_query_log.removeHandler(self.handler)
+
+    def test_untranslatable_query_is_logged_as_unicode(self):
+        instrumentation.log_slow_query(FailingEngine(), Query(price__ge = 10), None, 1.5)
+        self.assertEqual(self.handler.messages, [u"1.500s price >= 10 order=None"])
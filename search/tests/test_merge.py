@@ -0,0 +1,9 @@
+from search.exceptions import InvalidMergePolicyException
+from search.tests.base import WhooshTestCase
+
+
+class MergePolicyTest(WhooshTestCase):
+    whoosh_engines = {"bad_merge": {"merge": "fast"}}
+
+    def test_unknown_merge_policy_is_rejected(self):
+        self.assertRaises(InvalidMergePolicyException, self.database, "bad_merge")
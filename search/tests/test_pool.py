@@ -0,0 +1,56 @@
+from search.pool import Pool
+
+import unittest
+
+
+class Resource(object):
+    def __init__(self, version = 0):
+        self.version = version
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = Pool()
+
+    def test_get_reuses_objects(self):
+        first = self.pool.get("key", Resource)
+        self.assertTrue(self.pool.get("key", Resource) is first)
+
+    def test_shared_lease_reuses_resource(self):
+        with self.pool.lease("key", Resource) as first:
+            with self.pool.lease("key", Resource) as second:
+                self.assertTrue(first is second)
+
+    def test_replaced_resource_is_closed_after_last_release(self):
+        refresh = lambda resource: Resource(resource.version + 1)
+        with self.pool.lease("key", Resource) as old:
+            with self.pool.lease("key", Resource, refresh) as new:
+                self.assertEqual(new.version, 1)
+                self.assertFalse(old.closed)
+            self.assertFalse(old.closed)
+        self.assertTrue(old.closed)
+        self.assertFalse(new.closed)
+
+    def test_exclusive_leases_get_separate_resources(self):
+        with self.pool.lease("key", Resource, shared = False) as first:
+            with self.pool.lease("key", Resource, shared = False) as second:
+                self.assertFalse(first is second)
+        with self.pool.lease("key", Resource, shared = False) as third:
+            self.assertTrue(third is first or third is second)
+
+    def test_expired_resource_is_not_closed_while_leased(self):
+        with self.pool.lease("key", Resource, ttl = -1) as leased:
+            with self.pool.lease("other", Resource, ttl = -1):
+                self.assertFalse(leased.closed)
+        with self.pool.lease("other", Resource, ttl = -1):
+            self.assertTrue(leased.closed)
+
+    def test_clear_closes_idle_resources(self):
+        with self.pool.lease("key", Resource) as leased:
+            pass
+        self.pool.clear()
+        self.assertTrue(leased.closed)
@@ -0,0 +1,29 @@
+from search.query import Query, OR, Range
+from search.tests.base import SearchTestCase
+
+
+class SplitRangesTest(SearchTestCase):
+    def setUp(self):
+        SearchTestCase.setUp(self)
+        self.engine = self.database().engine
+
+    def test_repeated_bounds_are_intersected(self):
+        text, ranges = self.engine.split_ranges(Query(Query(price__ge = 5), Query(price__ge = 3), price__lt = 10))
+        self.assertEqual(text, u"")
+        self.assertEqual(ranges, (Range("price", 5, True, 10, False), ))
+
+    def test_ranges_under_or_stay_in_text(self):
+        text, ranges = self.engine.split_ranges(OR(price__ge = 5, title = u"red"))
+        self.assertEqual(ranges, ())
+        self.assertTrue(u"price:>=5" in text)
+
+    def test_ranges_on_text_fields_stay_in_text(self):
+        text, ranges = self.engine.split_ranges(Query(title__ge = u"b"))
+        self.assertEqual(ranges, ())
+        self.assertEqual(text, u"title:>=b")
+
+    def test_lifted_subqueries_leave_no_empty_group(self):
+        engine = self.database().engine
+        text, ranges = engine.split_ranges(Query(Query(price__ge = 1), title = u"red"))
+        self.assertEqual(text, u"title:red")
+        self.assertEqual(ranges, (Range("price", 1, True, None, True), ))
@@ -0,0 +1,119 @@
+from search.query import Query
+from search.tests.base import SearchTestCase, WhooshTestCase, products
+
+import threading
+
+
+class CommitSchedulerTest(SearchTestCase):
+    engines = {
+        "scheduled": {
+            "backend": "search.backends.memory.Backend",
+            "commit_scheduler": {"interval": 60, "max_pending": 1000, "max_queue": 50},
+        },
+    }
+
+    def setUp(self):
+        SearchTestCase.setUp(self)
+        name = self.unique_name()
+        self.first = self.database("scheduled", name = name)
+        self.second = self.database("scheduled", name = name)
+        self.scheduler = self.first.scheduler
+        self.engine = self.scheduler.engine
+
+    def block(self):
+        entered, release = threading.Event(), threading.Event()
+
+        def wait():
+            entered.set()
+            release.wait()
+        self.engine.block = wait
+        self.scheduler.submit("block")
+        return entered, release
+
+    def count(self, database):
+        return database.count(Query(title = u"product"))
+
+    def test_databases_share_the_scheduler(self):
+        self.assertTrue(self.second.scheduler is self.scheduler)
+        self.assertEqual(self.scheduler.queue.maxsize, 50)
+
+    def test_flush_commits_pending_writes(self):
+        self.first.add_many(products(5))
+        self.assertEqual(self.count(self.first), 0)
+        self.first.flush()
+        self.assertEqual(self.count(self.first), 5)
+        self.assertEqual(self.first.scheduler_stats()["commits"], 1)
+
+    def test_commit_waits_for_pending_writes(self):
+        self.first.add_many(products(5))
+        self.first.commit()
+        self.assertEqual(self.count(self.first), 5)
+
+    def test_close_commits_pending_writes(self):
+        self.first.add_many(products(3))
+        self.first.close()
+        self.assertEqual(self.count(self.second), 3)
+
+    def test_scheduler_close_drains_the_queue(self):
+        entered, release = self.block()
+        entered.wait()
+        self.first.add_many(products(4))
+        release.set()
+        self.scheduler.close()
+        self.assertFalse(self.scheduler.thread.is_alive())
+        self.assertEqual(self.count(self.second), 4)
+        self.assertRaises(RuntimeError, self.scheduler.submit, "add_many", [])
+
+    def test_rollback_cancels_only_own_queued_writes(self):
+        entered, release = self.block()
+        entered.wait()
+        self.first.add_many(products(5))
+        self.second.add_many(products(3, start = 10))
+        self.assertEqual(self.first.rollback(), 0)
+        release.set()
+        self.second.flush()
+        self.assertEqual(self.count(self.second), 3)
+
+    def test_rollback_reports_applied_writes(self):
+        self.first.add_many(products(2))
+        entered, release = self.block()
+        entered.wait()
+        self.assertEqual(self.first.rollback(), 1)
+        release.set()
+        self.second.flush()
+        self.assertEqual(self.count(self.second), 2)
+
+    def test_errors_reach_only_the_submitter(self):
+        add = self.engine.add
+
+        def fail(document):
+            if document.data["uuid"] == u"p0000":
+                raise ValueError(document.data["uuid"])
+            return add(document)
+        self.engine.add = fail
+        self.first.add(next(products(1)))
+        self.second.add_many(products(2, start = 5))
+        self.second.flush()
+        self.assertRaises(ValueError, self.first.flush)
+        self.first.flush()
+        self.assertEqual(self.count(self.first), 2)
+
+    def test_calls_run_after_pending_writes_are_committed(self):
+        self.first.add_many(products(4))
+        self.assertEqual(self.scheduler.call("count", Query(title = u"product")).result(), 4)
+
+
+class WhooshCommitSchedulerTest(WhooshTestCase):
+    whoosh_engines = {"scheduled": {}}
+
+    def setUp(self):
+        WhooshTestCase.setUp(self)
+        self.engines["scheduled"]["commit_scheduler"] = {"interval": 60}
+
+    def test_close_commits_pending_writes(self):
+        name = self.unique_name()
+        database = self.database("scheduled", name = name)
+        database.add_many(products(3))
+        database.close()
+        reader = self.database("scheduled", name = name)
+        self.assertEqual(reader.count(Query(title = u"product")), 3)
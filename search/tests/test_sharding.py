@@ -0,0 +1,68 @@
+from search.document import collation_key
+from search.query import Query
+from search.sharding import ShardedDatabase
+from search.tests.base import SearchTestCase, Product, ProductDatabase, products
+
+
+class ShardedProductDatabase(ShardedDatabase):
+    prefix      = ProductDatabase.prefix
+    document    = ProductDatabase.document
+    schema      = ProductDatabase.schema
+    shard_count = 3
+
+
+class ShardedMergeTest(SearchTestCase):
+    def setUp(self):
+        SearchTestCase.setUp(self)
+        self.database = self.fill(SearchTestCase.database(self, database_class = ShardedProductDatabase), 20)
+
+    def test_documents_are_spread_over_shards(self):
+        counts = [shard.count(Query(title = u"product")) for shard in self.database.engine.shards]
+        self.assertEqual(sum(counts), 20)
+        self.assertTrue(all(counts))
+
+    def test_pages_are_merged_by_order(self):
+        result = self.database.find(Query(title = u"product"), {"price": "asc"})
+        self.assertEqual([document.data["price"] for document in result.page(2, 6)], list(range(6, 12)))
+        self.assertEqual(result.rows, 20)
+
+    def test_sort_fields_use_collation(self):
+        result = self.database.find(Query(title = u"red"), {"title": "desc"})
+        titles = [document.data["title"] for document in result.page(1, 10)]
+        self.assertEqual(titles, sorted(titles, key = collation_key, reverse = True))
+
+    def test_cursor_paging_covers_all_hits(self):
+        pages = list(self.database.find(Query(title = u"product"), {"price": "desc"}).pages(6))
+        prices = [document.data["price"] for page in pages for document in page]
+        self.assertEqual(prices, list(range(19, -1, -1)))
+
+    def test_get_many_reads_from_owning_shards(self):
+        documents = self.database.get_many([u"p0003", u"p0017"])
+        self.assertEqual([data["price"] for data in documents], [3, 17])
+
+    def test_count_sums_shards(self):
+        self.assertEqual(self.database.count(Query(title = u"red")), 10)
+
+
+class ShardedFacetsTest(SearchTestCase):
+    def test_top_values_use_full_shard_counts(self):
+        database = SearchTestCase.database(self, database_class = ShardedProductDatabase)
+        shards = database.engine.shards
+        #w kazdym shardzie najczestsza jest jego wlasna wartosc (5 trafien),
+        #a w calej bazie - "common" (4 trafienia w kazdym shardzie)
+        placed = dict((id(shard), []) for shard in shards)
+        number = 0
+        while any(len(uuids) < 9 for uuids in placed.values()):
+            uuid = u"f%04d" % number
+            number += 1
+            uuids = placed[id(database.engine.shard_for(uuid))]
+            if len(uuids) < 9:
+                uuids.append(uuid)
+        documents = []
+        for index, shard in enumerate(shards):
+            for position, uuid in enumerate(placed[id(shard)]):
+                category = u"common" if position < 4 else u"local%d" % index
+                documents.append(Product({"uuid": uuid, "title": u"facet", "category": category, "price": position}))
+        database.add_many(documents)
+        database.commit()
+        self.assertEqual(database.facets(Query(title = u"facet"), ["category"], 1), {"category": {u"common": 12}})
@@ -0,0 +1,66 @@
+from search.exceptions import ReadOnlyDatabaseException
+from search.query import Query
+from search.tests.base import WhooshTestCase, products
+
+
+class SnapshotTestCase(WhooshTestCase):
+    whoosh_engines = {
+        "writer"  : {"publish_snapshots": True},
+        "snapshot": {"snapshot": True, "snapshot_interval": 0},
+        "plain"   : {},
+    }
+
+    def count(self, database):
+        return database.count(Query(title = u"product"))
+
+
+class SnapshotTest(SnapshotTestCase):
+    def setUp(self):
+        WhooshTestCase.setUp(self)
+        name = self.unique_name()
+        self.writer = self.fill(self.database("writer", name = name), 5)
+        self.reader = self.database("snapshot", name = name)
+
+    def test_reader_sees_published_generation(self):
+        self.assertEqual(self.count(self.reader), 5)
+        self.writer.add_many(products(3, start = 5))
+        self.writer.commit()
+        self.assertEqual(self.count(self.reader), 8)
+
+    def test_unpublished_commits_are_not_visible(self):
+        self.assertEqual(self.count(self.reader), 5)
+        self.writer.engine.publish_snapshots = False
+        self.writer.add_many(products(3, start = 5))
+        self.writer.commit()
+        self.assertEqual(self.count(self.reader), 5)
+        self.writer.engine.publish()
+        self.assertEqual(self.count(self.reader), 8)
+
+    def test_search_in_progress_keeps_its_generation(self):
+        with self.reader.engine.searcher() as searcher:
+            self.writer.add_many(products(3, start = 5))
+            self.writer.commit()
+            self.assertEqual(searcher.doc_count(), 5)
+        self.assertEqual(self.count(self.reader), 8)
+
+    def test_snapshot_is_read_only(self):
+        self.assertRaises(ReadOnlyDatabaseException, self.reader.optimize)
+
+    def test_deleted_generation_falls_back_to_newest(self):
+        self.writer.engine.publish_snapshots = False
+        self.writer.add_many(products(3, start = 5))
+        self.writer.commit()
+        #optimize usuwa pliki opublikowanej generacji
+        self.writer.optimize()
+        self.assertEqual(self.count(self.reader), 8)
+
+
+class UnpublishedSnapshotTest(SnapshotTestCase):
+    def test_reader_follows_latest_generation_without_publisher(self):
+        name = self.unique_name()
+        writer = self.fill(self.database("plain", name = name), 4)
+        reader = self.database("snapshot", name = name)
+        self.assertEqual(self.count(reader), 4)
+        writer.add_many(products(2, start = 4))
+        writer.commit()
+        self.assertEqual(self.count(reader), 6)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from search.document import collation_key
+from search.query import Query
+from search.tests.base import SearchTestCase, WhooshTestCase, ProductDatabase, products
+
+import os
+
+try:
+    from whoosh import index
+    from whoosh.fields import Schema, ID, COLUMN
+except ImportError:
+    pass
+
+
+class CollationKeyTest(SearchTestCase):
+    def test_ignores_case_spaces_and_accents(self):
+        self.assertEqual(collation_key(u"Żó te Ą").split(u"\x00")[0], u"zotea")
+
+    def test_accented_letters_sort_next_to_plain_ones(self):
+        words = [u"zebra", u"ósmy", u"Ósma", u"oko", u"ala"]
+        self.assertEqual(sorted(words, key = collation_key), [u"ala", u"oko", u"Ósma", u"ósmy", u"zebra"])
+
+    def test_memory_backend_sorts_by_collation_key(self):
+        database = self.fill(self.database(), 12)
+        titles = [document.data["title"] for document in database.find(Query(title = u"product"), {"title": "asc"}).page(1, 12)]
+        self.assertEqual(titles, sorted(titles, key = collation_key))
+
+
+class WhooshSortColumnTest(WhooshTestCase):
+    def setUp(self):
+        WhooshTestCase.setUp(self)
+        self.name = self.unique_name()
+
+    def create_legacy_index(self):
+        #schemat sprzed kolumn sortowania - __isort jako pole ID
+        engine = self.database("plain", name = self.name).engine
+        fields = dict((name, engine.schema[name]) for name in engine.schema.names())
+        fields["title__isort"] = ID(stored = False)
+        os.makedirs(engine.path)
+        index.create_in(engine.path, Schema(**fields))
+
+    def titles(self, database):
+        return [document.data["title"] for document in database.find(Query(title = u"product"), {"title": "desc"}).page(1, 20)]
+
+    def test_new_index_stores_sort_columns(self):
+        database = self.fill(self.database("plain", name = self.name), 6)
+        self.assertTrue(isinstance(database.engine.index.schema["title__isort"], COLUMN))
+        self.assertEqual(self.titles(database), sorted(self.titles(database), key = collation_key, reverse = True))
+
+    def test_legacy_index_accepts_writes_and_sorts(self):
+        self.create_legacy_index()
+        database = self.fill(self.database("plain", name = self.name), 6)
+        self.assertFalse(isinstance(database.engine.index.schema["title__isort"], COLUMN))
+        self.assertEqual(self.titles(database), sorted(self.titles(database), key = collation_key, reverse = True))
+
+    def test_rebuild_migrates_legacy_sort_fields(self):
+        self.create_legacy_index()
+        self.fill(self.database("plain", name = self.name), 3)
+        database = self.database("plain", name = self.name)
+        database.rebuild(products(8))
+        self.assertTrue(isinstance(database.engine.index.schema["title__isort"], COLUMN))
+        self.assertEqual(database.count(Query(title = u"product")), 8)
+        self.assertEqual(self.titles(database), sorted(self.titles(database), key = collation_key, reverse = True))
@@ -0,0 +1,200 @@
+"""
+Rozgrzewanie baz wyszukiwarki przy starcie procesu.
+
+Po wdrozeniu pierwsze zapytania kazdego workera placa za import backendu,
+otwarcie indeksu, pusty cache zapytan i zimny cache stron systemu
+operacyjnego. warmup() robi to zawczasu dla baz wymienionych w kluczu
+"warmup" silnikow settings.SEARCH:
+
+    SEARCH = {
+        "default": {
+            "backend": "search.backends.whoosh.Backend",
+            "params" : {"index_dir": "/var/lib/search"},
+            "warmup" : {
+                "databases": [
+                    {"database": "shop.search.ProductDatabase", "name": "products",
+                     "queries": "/var/log/search/products-slow.log", "limit": 200},
+                ],
+                "preload": True,
+            },
+        },
+    }
+
+Plik queries to log search.slowquery (linie "0.512s <zapytanie> order={...}",
+rowniez poprzedzone prefiksem formatera logowania) albo po prostu jedno
+zapytanie w skladni backendu na linie. Zapytania sa odtwarzane od
+najczestszych (najwyzej limit) jako RawQuery, razem z pierwsza strona
+dokumentow. preload wczytuje pliki indeksu do cache stron (posix_fadvise
+WILLNEED, a bez niego zwykly odczyt).
+
+Odtworzenie rozgrzewa searchery i polaczenia, parser backendu oraz dane
+indeksu potrzebne tym zapytaniom (cache stron, cache filtrow ES) - ale nie
+cache zapytan ani cache wynikow. RawQuery ma inne klucze niz Query, z
+ktorego powstal wpis w logu (tekst z zakresami, wezly AST, str(query)),
+a log nie zawiera tyle informacji, by go odtworzyc.
+
+Na koniec ustawiane jest ready i wolane sa funkcje zarejestrowane przez
+on_ready() - np. zglaszajace gotowosc workera do load balancera.
+
+Pula searcherow i polaczen oraz cache zapytan sa wspolne dla wszystkich
+watkow procesu, ale nie dla procesow - warmup trzeba wywolac w kazdym
+workerze (nie w procesie nadrzednym przed fork), typowo z hooka post_fork
+gunicorna:
+
+    def post_fork(server, worker):
+        from search import warmup
+        warmup.warmup()
+"""
+from django.db import settings
+from search.database import Database
+from search.query import RawQuery
+
+from ast import literal_eval
+import codecs
+import logging
+import os
+import re
+import threading
+import time
+
+log = logging.getLogger("search.warmup")
+
+ready = threading.Event()
+callbacks = []
+
+_slow_query = re.compile(r"\b\d+\.\d+s (.*) order=(.*)$")
+_chunk_size = 1024 * 1024
+
+
+def on_ready(callback):
+    callbacks.append(callback)
+    if ready.is_set():
+        callback()
+
+
+def is_ready():
+    return ready.is_set()
+
+
+"""
+Czyta zapytania z pliku - zwraca liste par (tekst, order) od najczestszych
+"""
+def read_queries(path, limit = None):
+    counts = {}
+    seen = []
+    with codecs.open(path, "r", "utf-8") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            text, order = line, None
+            match = _slow_query.search(line)
+            if match is not None:
+                text = match.group(1)
+                try:
+                    order = literal_eval(match.group(2))
+                except (ValueError, SyntaxError):
+                    order = None
+            key = (text, tuple(order.items()) if order else None)
+            if key not in counts:
+                counts[key] = 0
+                seen.append(key)
+            counts[key] += 1
+    #sort jest stabilny - przy rownej liczbie wystapien decyduje kolejnosc w pliku
+    seen.sort(key = lambda key: counts[key], reverse = True)
+    return [(text, dict(order) if order else None) for text, order in seen[:limit]]
+
+
+"""
+Wykonuje zapytania na bazie. Bledy pojedynczych zapytan (np. zapisanych
+przed zmiana schematu) sa logowane i pomijane. Zwraca liczbe udanych.
+"""
+def replay(database, queries, page_size = 10):
+    done = 0
+    for text, order in queries:
+        try:
+            database.find(RawQuery(text), order).page(1, page_size)
+            done += 1
+        except Exception:
+            log.warning("warmup query failed: %s", text, exc_info = True)
+    return done
+
+
+"""
+Wczytuje pliki do cache stron systemu operacyjnego. Zwraca liczbe bajtow.
+"""
+def preload(paths):
+    advise = getattr(os, "posix_fadvise", None)
+    size = 0
+    for path in paths:
+        try:
+            with open(path, "rb") as fp:
+                if advise is not None:
+                    advise(fp.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                    size += os.fstat(fp.fileno()).st_size
+                    continue
+                chunk = fp.read(_chunk_size)
+                while chunk:
+                    size += len(chunk)
+                    chunk = fp.read(_chunk_size)
+        except (IOError, OSError):
+            #pliki starych generacji moga zniknac w trakcie
+            pass
+    return size
+
+
+def warmup_database(config, engine, preload_files = False):
+    started = time.time()
+    database_class = Database.load_backend(config["database"])
+    database = database_class(config["name"], engine)
+    database.engine.warmup()
+
+    size = 0
+    if config.get("preload", preload_files):
+        size = preload(database.engine.index_files())
+
+    done = 0
+    if config.get("queries"):
+        queries = read_queries(config["queries"], config.get("limit", 100))
+        done = replay(database, queries, config.get("page_size", 10))
+
+    log.info("warmed up %s/%s (%s): %d queries, %d bytes preloaded in %.2fs",
+             database.prefix, config["name"], engine, done, size, time.time() - started)
+    return database
+
+
+"""
+Rozgrzewa bazy wszystkich silnikow (lub tylko podanych), po czym ustawia
+ready. Blad jednej bazy nie zatrzymuje pozostalych. Zwraca rozgrzane bazy.
+"""
+def warmup(engines = None):
+    started = time.time()
+    databases = []
+    for engine, search in settings.SEARCH.items():
+        if engines is not None and engine not in engines:
+            continue
+        config = search.get("warmup")
+        if not config:
+            continue
+        for database_config in config.get("databases", []):
+            try:
+                databases.append(warmup_database(database_config, engine, config.get("preload", False)))
+            except Exception:
+                log.exception("warmup of %s failed", database_config.get("name"))
+
+    log.info("search ready after %.2fs", time.time() - started)
+    ready.set()
+    for callback in callbacks:
+        callback()
+    return databases
+
+
+"""
+warmup() w watku w tle - proces moze od razu przyjmowac polaczenia,
+a gotowosc sprawdzac przez is_ready() / on_ready().
+"""
+def start(engines = None):
+    thread = threading.Thread(target = warmup, args = (engines, ), name = "search-warmup")
+    thread.daemon = True
+    thread.start()
+    return thread